@@ -3,7 +3,10 @@
 
 import os
 
-from celery import Celery
+from celery import (
+    Celery,
+    signals,
+)
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'qraz.settings')
@@ -16,3 +19,17 @@ app = Celery('qraz')
 # pickle the object when using Windows.
 app.config_from_object('django.conf:settings')
 app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
+
+
+@signals.celeryd_init.connect
+def apply_worker_profile(sender=None, conf=None, instance=None, **kwargs):
+    """
+    Restrict a worker to the queues and settings of the profile named by
+    `CELERY_WORKER_PROFILE`, e.g. `build` or `interactive`.
+    """
+    name = os.environ.get('CELERY_WORKER_PROFILE')
+    if not name:
+        return
+    profile = settings.CELERY_WORKER_PROFILES[name]
+    conf.update(profile['settings'])
+    instance.app.amqp.queues.select(profile['queues'])
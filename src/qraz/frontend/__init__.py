@@ -0,0 +1 @@
+default_app_config = 'qraz.frontend.apps.FrontendConfig'
@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from django.apps import AppConfig
+
+
+class FrontendConfig(AppConfig):
+    name = 'qraz.frontend'
+
+    def ready(self):
+        # Connect the signal receivers keeping the route index current.
+        from . import routes  # noqa
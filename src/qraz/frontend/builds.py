@@ -0,0 +1,522 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import errno
+import fcntl
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import pkg_resources
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# ioctl request to clone a file's extents on copy-on-write filesystems.
+FICLONE = 0x40049409
+
+# Name of the ETag manifest inside each published version.
+ETAGS = '.etags.json'
+
+COMPRESSIBLE_TYPES = (
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+)
+
+ENCODINGS = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+
+COMPRESSORS = [
+    ('gzip', ENCODINGS['gzip'], lambda data: gzip.compress(data, 9)),
+]
+if brotli:
+    COMPRESSORS.insert(0, ('br', ENCODINGS['br'], brotli.compress))
+
+# References to files in the reStructuredText sources: images and figures
+# copied by hovercraft, files read by docutils and the CSS and JavaScript
+# fields of the presentation, also copied by hovercraft.
+REFERENCE_RES = (
+    re.compile(r'^\s*\.\.\s+(?:image|figure)::\s*(\S+)\s*$', re.MULTILINE),
+    re.compile(r'^\s*:file:\s*(\S+)\s*$', re.MULTILINE),
+    re.compile(r'^:(?:css(?:-[\w-]+)?|js-header|js-body):[ \t]*(.+)$', re.MULTILINE),
+)
+INCLUDE_RE = re.compile(r'^\s*\.\.\s+include::\s*(\S+)\s*$', re.MULTILINE)
+# Fonts and images referenced from CSS, copied by hovercraft as well.
+CSS_URL_RE = re.compile(r'url\(\s*[\'"]?([^\'")]+)')
+
+etags_cache = {}
+etags_lock = threading.Lock()
+
+
+def hash_file(path, blocksize=65536):
+    """
+    Return the SHA-256 hex digest of the file at `path`.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for block in iter(lambda: stream.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_data(data):
+    """
+    Return the SHA-256 hex digest of a JSON serializable structure.
+    """
+    serialized = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def get_hovercraft_version():
+    """
+    Return a string identifying the installed hovercraft.
+
+    Falls back to the size and modification time of the binary if hovercraft
+    was not installed as a Python distribution.
+    """
+    try:
+        return pkg_resources.get_distribution('hovercraft').version
+    except pkg_resources.DistributionNotFound:
+        pass
+    try:
+        stat = os.stat(settings.HOVERCRAFT_BINARY)
+    except OSError:
+        return ''
+    return '{0.st_size}-{0.st_mtime_ns}'.format(stat)
+
+
+def resolve_assets(copy, assets):
+    """
+    Expand all asset globs inside the working copy.
+
+    Yields tuples of absolute source path and path relative to `copy` for
+    each file matched, directories are walked recursively.
+    """
+    for asset in assets:
+        asset_glob = os.path.realpath(
+            os.path.abspath(os.path.join(copy, asset))
+        )
+        if not os.path.commonpath([copy, asset_glob]).startswith(copy):
+            logger.warn("Malicious asset: %s", asset)
+            continue
+        for asset_source in sorted(glob.glob(asset_glob, recursive=True)):
+            if os.path.isdir(asset_source):
+                for root, dirs, files in os.walk(asset_source):
+                    dirs.sort()
+                    for each_file in sorted(files):
+                        path = os.path.join(root, each_file)
+                        yield path, os.path.relpath(path, copy)
+            else:
+                yield asset_source, os.path.relpath(asset_source, copy)
+
+
+def get_references(path):
+    """
+    Return the file references in the file at `path` and whether each one
+    is an included reStructuredText file.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as stream:
+            text = stream.read()
+    except OSError:
+        return []
+    if path.endswith('.css'):
+        return [(reference, False) for reference in CSS_URL_RE.findall(text)]
+    references = [(reference, True) for reference in INCLUDE_RE.findall(text)]
+    for reference_re in REFERENCE_RES:
+        for match in reference_re.findall(text):
+            references.extend((reference, False) for reference in match.split())
+    return references
+
+
+def get_resources(copy, source_path):
+    """
+    Return the sorted POSIX paths, relative to `copy`, of the files the
+    source file at `source_path` references.
+
+    Included files and CSS files are searched for further references. Each
+    reference is resolved relative to the file containing it and, as
+    hovercraft copies files relative to the source, references in included
+    files also relative to the source. URLs and files missing or outside
+    the working copy are left out.
+    """
+    resources = set()
+    pending = [source_path]
+    while pending:
+        path = pending.pop()
+        directories = set([os.path.dirname(path)])
+        if not path.endswith('.css'):
+            directories.add(os.path.dirname(source_path))
+        for reference, included in get_references(path):
+            if '://' in reference or reference.startswith(('data:', '//', '#')):
+                continue
+            reference = reference.split('#', 1)[0].split('?', 1)[0]
+            for directory in directories:
+                target = os.path.realpath(os.path.join(directory, reference))
+                if not os.path.commonpath([copy, target]).startswith(copy) or not os.path.isfile(target):
+                    continue
+                relative = os.path.relpath(target, copy).replace(os.sep, '/')
+                if relative in resources:
+                    continue
+                resources.add(relative)
+                if included or target.endswith('.css'):
+                    pending.append(target)
+    return sorted(resources)
+
+
+def get_manifest(copy, source_path, data, version, index, resources):
+    """
+    Return the content addressed build manifest for one presentation.
+
+    The manifest covers everything a hovercraft build depends on: the source
+    file, the `resources` it references, all resolved assets, the
+    presentation's configuration entry and the hovercraft version used to
+    render it. Files are identified by their git blob IDs from `index`, only
+    files missing there are hashed.
+    """
+    source = os.path.relpath(source_path, copy).replace(os.sep, '/')
+    return {
+        'source': index.get(source) or hash_file(source_path),
+        'resources': dict(
+            (path, index.get(path) or hash_file(os.path.join(copy, path)))
+            for path in resources
+        ),
+        'assets': dict(
+            (path, index.get(path.replace(os.sep, '/')) or hash_file(asset))
+            for asset, path in resolve_assets(copy, data.get('assets', []))
+        ),
+        'config': hash_data(data),
+        'hovercraft': version,
+    }
+
+
+def clone_file(source, target):
+    """
+    Copy `source` to `target`, sharing extents through a reflink where the
+    filesystem supports it.
+    """
+    try:
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+    except OSError as excp:
+        if excp.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL):
+            raise
+    shutil.copyfile(source, target)
+
+
+def get_blobs():
+    return os.path.join(settings.HOVERCRAFT_ROOT, 'blobs')
+
+
+def get_blob(name):
+    return os.path.join(get_blobs(), name[:2], name)
+
+
+def write_blob(blob, write):
+    """
+    Atomically create `blob` by calling `write` with a temporary path in the
+    blob store.
+    """
+    directory = os.path.dirname(blob)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=directory)
+    os.close(fd)
+    try:
+        write(temp)
+        os.chmod(temp, 0o644)
+        os.replace(temp, blob)
+    except OSError:
+        os.unlink(temp)
+        raise
+
+
+def store_blob(path, digest=None):
+    """
+    Add the file at `path` to the content addressed blob store unless it is
+    already present and return the path of its blob.
+
+    If known, `digest` names the blob, which is either the SHA-256 digest or
+    the git blob ID of the file, so present blobs cost no reads.
+    """
+    blob = get_blob(digest or hash_file(path))
+    if not os.path.exists(blob):
+        write_blob(blob, lambda temp: clone_file(path, temp))
+    return blob
+
+
+def link_blob(blob, target):
+    """
+    Hardlink `blob` to `target`, replacing anything already there.
+
+    Falls back to a reflink or copy if the blob store is on another
+    filesystem. Existing files are never written to in place, as they may
+    share their inode with a blob.
+    """
+    temp = '{}.{}'.format(target, os.path.basename(blob)[:16])
+    try:
+        os.link(blob, temp)
+    except OSError as excp:
+        if excp.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+            raise
+        clone_file(blob, temp)
+    os.replace(temp, target)
+
+
+def collect_blobs():
+    """
+    Remove blobs no longer linked from any version.
+
+    Blobs whose link count changed within the grace period are kept, as a
+    running build may be about to link them.
+    """
+    deadline = time.time() - settings.HOVERCRAFT_GRACE_PERIOD
+    for root, dirs, files in os.walk(get_blobs()):
+        for each_file in files:
+            path = os.path.join(root, each_file)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if stat.st_nlink == 1 and stat.st_ctime < deadline:
+                logger.debug('Removing blob %s', path)
+                os.unlink(path)
+
+
+def is_compressible(path):
+    mime_type, encoding = mimetypes.guess_type(path)
+    if encoding or not mime_type:
+        return False
+    return mime_type.startswith('text/') or mime_type in COMPRESSIBLE_TYPES
+
+
+def write_compressed(source, compressor):
+    def write(temp):
+        with open(source, 'rb') as stream:
+            data = compressor(stream.read())
+        with open(temp, 'wb') as stream:
+            stream.write(data)
+    return write
+
+
+def finalize(staging, digests=None):
+    """
+    Add precompressed siblings for all compressible files in `staging` and
+    write the ETag manifest of the build.
+
+    `digests` maps POSIX paths relative to `staging` to known digests of
+    their files, only the other files are hashed. Compressed variants are
+    kept in the blob store keyed by the digest of their source, so unchanged
+    files are never compressed twice. A variant is only linked if it is
+    smaller than its source.
+    """
+    digests = digests or {}
+    etags = {}
+    for root, dirs, files in os.walk(staging):
+        for each_file in files:
+            path = os.path.join(root, each_file)
+            relative = os.path.relpath(path, staging).replace(os.sep, '/')
+            digest = digests.get(relative) or hash_file(path)
+            encodings = []
+            size = os.path.getsize(path)
+            if size >= settings.HOVERCRAFT_COMPRESS_MIN_SIZE and is_compressible(path):
+                for encoding, suffix, compressor in COMPRESSORS:
+                    blob = get_blob(digest + suffix)
+                    if not os.path.exists(blob):
+                        write_blob(blob, write_compressed(path, compressor))
+                    if os.path.getsize(blob) < size:
+                        link_blob(blob, path + suffix)
+                        encodings.append(encoding)
+            etags[relative] = {
+                'etag': digest,
+                'encodings': encodings,
+            }
+    with open(os.path.join(staging, ETAGS), 'w') as stream:
+        json.dump(etags, stream)
+
+
+def load_etags(version):
+    """
+    Return the ETag manifest of a published version, which is immutable and
+    therefore cached per process.
+    """
+    with etags_lock:
+        if version in etags_cache:
+            return etags_cache[version]
+    try:
+        with open(os.path.join(version, ETAGS)) as stream:
+            etags = json.load(stream)
+    except (OSError, ValueError):
+        return {}
+    with etags_lock:
+        if len(etags_cache) >= 256:
+            etags_cache.clear()
+        etags_cache[version] = etags
+    return etags
+
+
+def get_target(pk):
+    """
+    Return the published output path of a presentation.
+
+    This is a symlink into the presentation's versions directory.
+    """
+    return os.path.join(settings.HOVERCRAFT_ROOT, str(pk))
+
+
+def get_versions(pk):
+    return os.path.join(settings.HOVERCRAFT_ROOT, 'versions', str(pk))
+
+
+def publish(pk, staging):
+    """
+    Turn the staging directory into a new version and atomically point the
+    presentation's published output at it.
+    """
+    versions = get_versions(pk)
+    version = os.path.join(
+        versions,
+        '{}-{}'.format(int(time.time()), os.path.basename(staging).rsplit('-', 1)[-1])
+    )
+    os.rename(staging, version)
+    target = get_target(pk)
+    previous = os.path.realpath(target) if os.path.islink(target) else None
+    link = '{}.{}'.format(target, os.path.basename(version))
+    os.symlink(os.path.relpath(version, settings.HOVERCRAFT_ROOT), link)
+    try:
+        os.replace(link, target)
+    except IsADirectoryError:
+        # Output published before versioning was a plain directory.
+        shutil.rmtree(target)
+        os.replace(link, target)
+    if previous and os.path.isdir(previous):
+        # Start the grace period of the superseded version now.
+        os.utime(previous)
+    collect(pk)
+    return version
+
+
+def collect(pk):
+    """
+    Remove superseded versions and abandoned staging directories once their
+    grace period has passed.
+    """
+    versions = get_versions(pk)
+    current = os.path.realpath(get_target(pk))
+    now = time.time()
+    removed = False
+    for name in os.listdir(versions):
+        path = os.path.join(versions, name)
+        if path == current:
+            continue
+        grace = settings.HOVERCRAFT_GRACE_PERIOD
+        if name.startswith('.staging-'):
+            grace += settings.HOVERCRAFT_TIMEOUT
+        try:
+            if os.stat(path).st_mtime > now - grace:
+                continue
+        except OSError:
+            continue
+        logger.debug('Removing version %s', path)
+        shutil.rmtree(path, ignore_errors=True)
+        removed = True
+    if removed:
+        collect_blobs()
+
+
+def remove(pk):
+    """
+    Remove the published output and all versions of a deleted presentation.
+
+    Blobs no longer linked from anywhere are left to `collect_blobs`.
+    """
+    target = get_target(pk)
+    if os.path.islink(target):
+        os.unlink(target)
+    elif os.path.isdir(target):
+        shutil.rmtree(target, ignore_errors=True)
+    shutil.rmtree(get_versions(pk), ignore_errors=True)
+
+
+def build(copy, presentation, assets, index=None):
+    """
+    Render one presentation into a staging directory, link its assets from
+    the blob store and publish it.
+
+    Assets are keyed in the blob store and the ETag manifest by their git
+    blob IDs from `index`, so unchanged assets are never read. Only files
+    generated by hovercraft and assets missing there are hashed.
+
+    The previously published version keeps being served until the new one
+    is complete, and stays in place if the build fails. May run in worker
+    threads, so it must not touch the database. Returns a result dictionary
+    for the task result.
+    """
+    versions = get_versions(presentation.pk)
+    os.makedirs(versions, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=versions)
+    os.chmod(staging, 0o755)
+    started = time.monotonic()
+    try:
+        subprocess.run(
+            [
+                settings.HOVERCRAFT_BINARY,
+                os.path.join(copy, presentation.path),
+                staging
+            ],
+            timeout=settings.HOVERCRAFT_TIMEOUT,
+            check=True
+        )
+        digests = {}
+        for asset_source, path in resolve_assets(copy, assets):
+            relative = path.replace(os.sep, '/')
+            digest = None
+            if index and not os.path.islink(asset_source):
+                # Git blob IDs of symlinks are those of their target paths.
+                digest = index.get(relative)
+            digests[relative] = digest or hash_file(asset_source)
+            asset_target = os.path.join(staging, path)
+            os.makedirs(os.path.dirname(asset_target), exist_ok=True)
+            link_blob(store_blob(asset_source, digests[relative]), asset_target)
+        finalize(staging, digests)
+        publish(presentation.pk, staging)
+    except subprocess.TimeoutExpired:
+        logger.warn('Hovercraft timed out for %s', presentation.name)
+        error = 'timeout'
+    except subprocess.CalledProcessError as excp:
+        logger.warn('Hovercraft failed for %s: %d', presentation.name, excp.returncode)
+        error = 'hovercraft exited with {}'.format(excp.returncode)
+    except OSError as excp:
+        logger.warn('Build failed for %s: %s', presentation.name, excp)
+        error = str(excp)
+    else:
+        error = None
+    if error:
+        shutil.rmtree(staging, ignore_errors=True)
+    return {
+        'name': presentation.name,
+        'built': True,
+        'success': error is None,
+        'error': error,
+        'duration': time.monotonic() - started,
+    }
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class GithubError(Exception):
+
+    def __init__(self, status, message):
+        super(GithubError, self).__init__(status, message)
+        self.status = status
+        self.message = message
+
+    def __str__(self):
+        return '{self.status}: {self.message}'.format(self=self)
+
+
+class RateLimited(Exception):
+    """
+    Raised instead of sending a request that would run into Github's rate
+    limit. Celery tasks should retry after `retry_after` seconds.
+
+    Deliberately not a `GithubError`, so it is not swallowed by code
+    handling failed API calls.
+    """
+
+    def __init__(self, retry_after):
+        super(RateLimited, self).__init__(retry_after)
+        self.retry_after = max(int(retry_after) + 1, 1)
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket pacing requests once the rate limit gets close.
+    """
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def configure(self, capacity, rate, tokens=None):
+        """
+        Change capacity and refill rate, optionally resetting the tokens
+        available right now.
+        """
+        with self.lock:
+            self.refill()
+            self.capacity = capacity
+            self.rate = rate
+            if tokens is None:
+                tokens = self.tokens
+            self.tokens = min(tokens, capacity)
+
+    def reserve(self):
+        """
+        Take one token and return the number of seconds to wait before it
+        may be used, or `None` if no tokens are refilled at all.
+        """
+        with self.lock:
+            self.refill()
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            if not self.rate:
+                return None
+            return -self.tokens / self.rate
+
+    def refund(self):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class GithubClient(object):
+    """
+    Minimal Github API client sending conditional requests.
+
+    The ETag and Last-Modified validators of every GET response are stored
+    in the Django cache together with the response data, keyed by endpoint
+    and access token. Later requests for the same endpoint send them along
+    and are answered from the cache if Github responds with 304, which does
+    not count against the rate limit.
+    """
+    counter_key = 'qraz:github:{}'
+
+    def __init__(self, token, base_url=None):
+        self.token = token
+        self.base_url = (base_url or settings.GITHUB_API_URL).rstrip('/')
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=settings.GITHUB_POOL_SIZE))
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=settings.GITHUB_POOL_SIZE))
+        self.session.headers.update({
+            'Accept': 'application/vnd.github.v3+json',
+            'Authorization': 'token {}'.format(token),
+        })
+        self.bucket = TokenBucket(settings.GITHUB_BURST, 5000 / 3600)
+        self.reset = None
+        self.login = None
+
+    @classmethod
+    def get_stats(cls):
+        """
+        Return the number of conditional requests served from the cache and
+        the number of requests that had to be answered by Github.
+        """
+        return {
+            name: cache.get(cls.counter_key.format(name), 0)
+            for name in ('hits', 'misses')
+        }
+
+    def count(self, name):
+        key = self.counter_key.format(name)
+        if not cache.add(key, 1, None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, 1, None)
+
+    def get_url(self, path):
+        if path.startswith('http'):
+            return path
+        return '{}/{}'.format(self.base_url, path.lstrip('/'))
+
+    def get_cache_key(self, url):
+        digest = hashlib.sha256('{}:{}'.format(self.token, url).encode('utf-8'))
+        return 'qraz:github:response:{}'.format(digest.hexdigest())
+
+    def throttle(self):
+        """
+        Wait for a token from the bucket, or raise `RateLimited` if that
+        would take longer than `GITHUB_MAX_WAIT` seconds.
+        """
+        wait = self.bucket.reserve()
+        if wait is None or wait > settings.GITHUB_MAX_WAIT:
+            self.bucket.refund()
+            if wait is None:
+                wait = (self.reset or time.time() + 60) - time.time()
+            raise RateLimited(wait)
+        if wait:
+            time.sleep(wait)
+
+    def track(self, response):
+        """
+        Adapt the bucket to the remaining rate limit, keeping
+        `GITHUB_RATE_LIMIT_RESERVE` requests in reserve.
+
+        As long as more than `GITHUB_BURST` requests are left above the
+        reserve, all of them may be spent without waiting. Only the last
+        ones are spread over the rest of the rate limit window.
+        """
+        headers = response.headers
+        if 'X-RateLimit-Remaining' not in headers or 'X-RateLimit-Reset' not in headers:
+            return
+        remaining = int(headers['X-RateLimit-Remaining']) - settings.GITHUB_RATE_LIMIT_RESERVE
+        self.reset = int(headers['X-RateLimit-Reset'])
+        window = max(self.reset - time.time(), 1)
+        if remaining > settings.GITHUB_BURST:
+            self.bucket.configure(remaining, remaining / window, tokens=remaining)
+        else:
+            self.bucket.configure(1, max(remaining, 0) / window)
+
+    def send(self, method, url, **kwargs):
+        self.throttle()
+        response = self.session.request(
+            method,
+            url,
+            timeout=settings.GITHUB_TIMEOUT,
+            **kwargs
+        )
+        self.track(response)
+        if response.status_code in (403, 429) and (
+                'Retry-After' in response.headers or
+                response.headers.get('X-RateLimit-Remaining') == '0'):
+            if 'Retry-After' in response.headers:
+                retry_after = int(response.headers['Retry-After'])
+            else:
+                retry_after = (self.reset or time.time() + 60) - time.time()
+            logger.warn('Github rate limit hit, retry in %ds', retry_after)
+            raise RateLimited(retry_after)
+        return response
+
+    def check(self, response):
+        if response.status_code >= 400:
+            try:
+                message = response.json().get('message', response.reason)
+            except ValueError:
+                message = response.reason
+            raise GithubError(response.status_code, message)
+
+    def request(self, method, path, **kwargs):
+        response = self.send(method, self.get_url(path), **kwargs)
+        self.check(response)
+        return response
+
+    def fetch(self, url):
+        """
+        Conditionally GET `url` and return its data and the URL of the next
+        page, if any.
+        """
+        key = self.get_cache_key(url)
+        cached = cache.get(key)
+        headers = {}
+        if cached:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+        response = self.send('GET', url, headers=headers)
+        if response.status_code == 304 and cached:
+            # Conditional requests answered with 304 are free.
+            self.bucket.refund()
+            self.count('hits')
+            return cached['data'], cached['next']
+        self.check(response)
+        self.count('misses')
+        data = response.json()
+        url_next = response.links.get('next', {}).get('url')
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            cache.set(
+                key,
+                {
+                    'etag': etag,
+                    'last_modified': last_modified,
+                    'data': data,
+                    'next': url_next,
+                },
+                settings.GITHUB_CACHE_TIMEOUT
+            )
+        return data, url_next
+
+    def get(self, path):
+        return self.fetch(self.get_url(path))[0]
+
+    def get_all(self, path):
+        """
+        Return the items of all pages of a paginated listing.
+        """
+        items = []
+        url = self.get_url(path)
+        while url:
+            data, url = self.fetch(url)
+            items.extend(data)
+        return items
+
+    def get_user(self):
+        return self.get('user')
+
+    def get_repos(self):
+        return self.get_all('user/repos?per_page=100')
+
+    def get_login(self):
+        """
+        Return the login of the token's user, which never changes for a
+        token and is therefore only requested once per client.
+        """
+        if self.login is None:
+            self.login = self.get_user()['login']
+        return self.login
+
+    def get_repo(self, name):
+        return self.get('repos/{}/{}'.format(self.get_login(), name))
+
+    def create_hook(self, repo, name, config, events, active=True):
+        return self.request(
+            'POST',
+            repo['hooks_url'],
+            json={
+                'name': name,
+                'config': config,
+                'events': events,
+                'active': active,
+            }
+        ).json()
+
+    def delete_hook(self, repo, hook):
+        self.request('DELETE', '{}/{}'.format(repo['hooks_url'], hook))
+
+
+clients = {}
+clients_lock = threading.Lock()
+
+
+def get_client(token):
+    """
+    Return the process wide client for `token`, keeping its HTTP connections
+    and rate limit state alive across tasks.
+    """
+    with clients_lock:
+        if token not in clients:
+            clients[token] = GithubClient(token)
+        return clients[token]
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+
+def to_bool(value):
+    value = value.lower()
+    if value in ('1', 'true', 'yes'):
+        return True
+    if value in ('0', 'false', 'no'):
+        return False
+    raise ValueError(value)
+
+
+class QueryParameterFilter(BaseFilterBackend):
+    """
+    Filter a view's queryset by query parameters.
+
+    Views declare the supported parameters in `filter_lookups`, mapping each
+    parameter name to a field lookup and a function converting the value.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        lookups = {}
+        errors = {}
+        for name, (lookup, convert) in getattr(view, 'filter_lookups', {}).items():
+            if name not in request.query_params:
+                continue
+            try:
+                lookups[lookup] = convert(request.query_params[name])
+            except ValueError:
+                errors[name] = ['Invalid value.']
+        if errors:
+            raise ValidationError(errors)
+        return queryset.filter(**lookups)
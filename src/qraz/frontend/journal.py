@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import datetime
+import logging
+import threading
+import uuid
+
+from django.conf import settings
+from django.db import (
+    IntegrityError,
+    connection,
+    transaction,
+)
+from django.db.models import Q
+from django.utils import timezone
+
+from celery import current_app
+
+from . import tasks
+from .models import Event
+
+logger = logging.getLogger(__name__)
+
+# Task IDs of events claimed by a dispatcher but not handed on yet.
+CLAIM_PREFIX = 'claim:'
+
+wakeup = threading.Event()
+dispatcher = None
+dispatcher_lock = threading.Lock()
+
+
+def record(delivery, repository_pk, head=None):
+    """
+    Append a webhook delivery to the journal.
+
+    Returns `False` if the delivery was journaled before, which happens when
+    Github redelivers it.
+    """
+    try:
+        with transaction.atomic():
+            Event.objects.create(
+                delivery=delivery,
+                repository_id=repository_pk,
+                head=head or ''
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def get_pending():
+    """
+    Return the events waiting to be dispatched, including those claimed by
+    a dispatcher that died before finishing them.
+    """
+    deadline = timezone.now() - datetime.timedelta(seconds=settings.EVENT_DISPATCH_CLAIM_TIMEOUT)
+    return Event.objects.filter(
+        Q(dispatched=None) | Q(task__startswith=CLAIM_PREFIX, dispatched__lt=deadline)
+    )
+
+
+def dispatch(batch_size=None, **options):
+    """
+    Hand the oldest pending events to the build coalescer and return the
+    number of events dispatched.
+
+    Events of the same repository within a batch are merged into one build
+    of the tip of the default branch, the recorded heads are informational
+    only, as Github does not deliver pushes in order. If the broker fails,
+    the remaining events stay pending for the next call.
+
+    Events are claimed with a conditional update before they are handed
+    on, so concurrent dispatchers never dispatch an event twice on any
+    database backend. Further `options` are passed on to `apply_async`.
+    """
+    batch = collections.OrderedDict()
+    rows = get_pending().values_list('pk', 'repository_id')
+    for pk, repository_pk in rows[:batch_size or settings.EVENT_DISPATCH_BATCH_SIZE]:
+        batch.setdefault(repository_pk, []).append(pk)
+    dispatched = 0
+    for repository_pk, pks in batch.items():
+        claim = '{}{}'.format(CLAIM_PREFIX, uuid.uuid4().hex[:30])
+        claimed = get_pending().filter(pk__in=pks).update(dispatched=timezone.now(), task=claim)
+        if not claimed:
+            # Taken by another dispatcher in the meantime.
+            continue
+        try:
+            task_id, coalesced = tasks.BuildCoalescer(repository_pk).submit(**options)
+        except Exception as excp:
+            # Transports raise different errors while the broker is down.
+            logger.warn('Dispatching events failed: %s', excp)
+            Event.objects.filter(task=claim).update(dispatched=None, task='')
+            break
+        Event.objects.filter(task=claim).update(task=task_id or '')
+        dispatched += claimed
+    return dispatched
+
+
+def run():
+    """
+    Dispatch events whenever woken by `notify`, using a broker connection
+    that gives up after `EVENT_DISPATCH_CONNECT_TIMEOUT` seconds.
+    """
+    while True:
+        wakeup.wait()
+        wakeup.clear()
+        try:
+            with current_app.connection(connect_timeout=settings.EVENT_DISPATCH_CONNECT_TIMEOUT) as broker:
+                while dispatch(connection=broker, retry=False) >= settings.EVENT_DISPATCH_BATCH_SIZE:
+                    continue
+        except Exception:
+            logger.exception('Dispatching events failed')
+        finally:
+            # The thread outlives requests, which close their connections.
+            connection.close()
+
+
+def notify():
+    """
+    Wake the dispatcher thread of this process to dispatch journaled events
+    outside of the request, starting it if needed.
+
+    Events it cannot dispatch are left to the `dispatch_events` command.
+    """
+    global dispatcher
+    with dispatcher_lock:
+        if dispatcher is None or not dispatcher.is_alive():
+            dispatcher = threading.Thread(target=run, name='qraz-journal')
+            dispatcher.daemon = True
+            dispatcher.start()
+    wakeup.set()
+
+
+def purge():
+    """
+    Remove dispatched events once redeliveries of them are no longer
+    expected.
+    """
+    deadline = timezone.now() - datetime.timedelta(seconds=settings.EVENT_RETENTION)
+    Event.objects.filter(dispatched__lt=deadline).delete()
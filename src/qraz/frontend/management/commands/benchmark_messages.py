@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+from django.core.management.base import (
+    BaseCommand,
+    CommandError,
+)
+
+from kombu import Connection
+from kombu.serialization import dumps
+
+from qraz.frontend.models import Repository
+
+
+class Command(BaseCommand):
+    help = 'Compare size and throughput of pickled model and primary key task messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--messages',
+            type=int,
+            default=10000,
+            help='Number of messages to enqueue and dequeue per payload'
+        )
+        parser.add_argument(
+            '--repository',
+            type=int,
+            help='Primary key of the repository to use, defaults to the first one'
+        )
+
+    def get_payloads(self, repository):
+        head = 'a' * 40
+        return [
+            ('build (pickled instance)', 'pickle', ((repository, head), {})),
+            ('build (primary key)', 'json', ((repository.pk, head), {})),
+            ('sync (pickled instances)', 'pickle', ((repository.user, repository.site), {})),
+            ('sync (primary keys)', 'json', ((repository.user.pk, repository.site.pk), {})),
+        ]
+
+    def measure(self, serializer, payload, count):
+        with Connection('memory://') as connection:
+            queue = connection.SimpleQueue('qraz.benchmark', serializer=serializer)
+            started = time.perf_counter()
+            for _ in range(count):
+                queue.put(payload)
+            enqueued = time.perf_counter()
+            for _ in range(count):
+                message = queue.get(timeout=1)
+                message.decode()
+                message.ack()
+            dequeued = time.perf_counter()
+            queue.close()
+        return count / (enqueued - started), count / (dequeued - enqueued)
+
+    def handle(self, *args, **options):
+        queryset = Repository.objects.select_related('user', 'site')
+        if options['repository']:
+            queryset = queryset.filter(pk=options['repository'])
+        repository = queryset.first()
+        if repository is None:
+            raise CommandError('No repository to benchmark with')
+        self.stdout.write('{:<28} {:>10} {:>14} {:>14}'.format('payload', 'bytes', 'enqueue/s', 'dequeue/s'))
+        for name, serializer, payload in self.get_payloads(repository):
+            content_type, encoding, data = dumps(payload, serializer=serializer)
+            enqueue, dequeue = self.measure(serializer, payload, options['messages'])
+            self.stdout.write('{:<28} {:>10} {:>14.0f} {:>14.0f}'.format(name, len(data), enqueue, dequeue))
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from qraz.frontend import journal
+
+
+class Command(BaseCommand):
+    help = 'Dispatch journaled webhook events to Celery'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Drain the journal once and exit'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.EVENT_DISPATCH_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=settings.EVENT_DISPATCH_INTERVAL,
+            help='Seconds to wait while the journal is empty'
+        )
+
+    def handle(self, *args, **options):
+        purged = 0
+        while True:
+            dispatched = journal.dispatch(options['batch_size'])
+            if time.monotonic() - purged > 60:
+                journal.purge()
+                purged = time.monotonic()
+            if options['once'] and dispatched < options['batch_size']:
+                return
+            if dispatched < options['batch_size']:
+                time.sleep(options['interval'])
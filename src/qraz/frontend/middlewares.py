@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from django_downloadview.apache import XSendfileMiddleware as BaseXSendfileMiddleware
+
+
+class XSendfileMiddleware(BaseXSendfileMiddleware):
+    """
+    Apache X-Sendfile backend keeping the negotiated headers of the original
+    download response, which the stock backend drops.
+    """
+    preserved_headers = (
+        'Content-Encoding',
+        'ETag',
+        'Vary',
+        'Cache-Control',
+    )
+
+    def process_download_response(self, request, response):
+        proxied = super(XSendfileMiddleware, self).process_download_response(request, response)
+        if proxied is not response:
+            for header in self.preserved_headers:
+                if header in response:
+                    proxied[header] = response[header]
+        return proxied
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('frontend', '0004_auto_20160120_1134'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='presentation',
+            name='manifest',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Digest of last build manifest'),
+        ),
+    ]
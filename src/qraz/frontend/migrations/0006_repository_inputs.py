@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('frontend', '0005_presentation_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repository',
+            name='inputs',
+            field=models.TextField(blank=True, default='', verbose_name='Presentation inputs from last known configuration'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('frontend', '0006_repository_inputs'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='repository',
+            index_together=set([('site', 'user', 'name'), ('site', 'user', 'state')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='presentation',
+            index_together=set([('repository', 'name')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('frontend', '0007_api_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Event',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delivery', models.CharField(max_length=64, unique=True, verbose_name='Github delivery ID')),
+                ('head', models.CharField(blank=True, default='', max_length=40, verbose_name='Head commit to build')),
+                ('received', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='Received')),
+                ('dispatched', models.DateTimeField(db_index=True, null=True, verbose_name='Dispatched')),
+                ('task', models.CharField(blank=True, default='', max_length=36, verbose_name='ID of build task')),
+                ('repository', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='frontend.Repository')),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+    ]
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import contextlib
+import fcntl
+import logging
+import os
+import re
+import shutil
+
+import pygit2
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MirrorCache(object):
+    """
+    Persistent cache of bare repository mirrors on local disk.
+
+    Each mirror is fetched incrementally from its remote and trees are
+    exported from it into working directories, so a build only pays for the
+    objects that changed since the last fetch. Mirrors that have not been
+    used recently are evicted once the cache exceeds its disk budget.
+    """
+    refspec = '+refs/*:refs/*'
+    commit_re = re.compile(r'^[0-9a-f]{40}$')
+
+    def __init__(self, root=None, budget=None):
+        self.root = root or settings.GIT_MIRROR_ROOT
+        if budget is None:
+            budget = settings.GIT_MIRROR_CACHE_SIZE
+        self.budget = budget
+
+    def get_path(self, key):
+        return os.path.join(self.root, '{}.git'.format(key))
+
+    @contextlib.contextmanager
+    def lock(self, path, blocking=True):
+        """
+        Hold an exclusive lock on the mirror at `path` across processes.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open('{}.lock'.format(path), 'w') as stream:
+            flags = fcntl.LOCK_EX
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            fcntl.flock(stream, flags)
+            try:
+                yield
+            finally:
+                fcntl.flock(stream, fcntl.LOCK_UN)
+
+    def fetch(self, path, url, revision=None):
+        """
+        Create or fetch the mirror at `path` from `url`, the caller must hold
+        its lock.
+
+        The fetch is skipped if `revision` is the SHA of a commit already
+        present in the mirror.
+        """
+        if os.path.isdir(path):
+            repo = pygit2.Repository(path)
+            if repo.remotes['origin'].url != url:
+                repo.remotes.set_url('origin', url)
+        else:
+            logger.info('Creating mirror for %s', url)
+            repo = pygit2.init_repository(path, bare=True)
+            repo.remotes.create('origin', url, self.refspec)
+        if not (revision and self.commit_re.match(revision) and revision in repo):
+            logger.debug('Fetching %s', url)
+            repo.remotes['origin'].fetch()
+        os.utime(path)
+        return repo
+
+    def checkout(self, key, url, revision, directory, index=None):
+        """
+        Export the tree of `revision` from the mirror for `key` into
+        `directory` without any history and return the commit SHA.
+
+        If given, `index` is filled with the git blob ID of every exported
+        file, keyed by its POSIX path relative to `directory`.
+        """
+        path = self.get_path(key)
+        with self.lock(path):
+            repo = self.fetch(path, url, revision)
+            commit = repo.revparse_single(revision).peel(pygit2.Commit)
+            self.export(repo, commit.tree, directory, index)
+        self.evict(keep=path)
+        return str(commit.id)
+
+    def remove(self, key):
+        """
+        Remove the mirror for `key`, waiting for builds using it.
+        """
+        path = self.get_path(key)
+        if not os.path.isdir(path):
+            return
+        with self.lock(path):
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.unlink('{}.lock'.format(path))
+        except FileNotFoundError:
+            pass
+
+    def export(self, repo, tree, directory, index=None, prefix=''):
+        for entry in tree:
+            path = os.path.join(directory, entry.name)
+            if entry.filemode == pygit2.GIT_FILEMODE_TREE:
+                os.mkdir(path)
+                self.export(repo, repo[entry.id], path, index, '{}{}/'.format(prefix, entry.name))
+                continue
+            if entry.filemode == pygit2.GIT_FILEMODE_COMMIT:
+                os.mkdir(path)
+                continue
+            if index is not None:
+                index[prefix + entry.name] = str(entry.id)
+            if entry.filemode == pygit2.GIT_FILEMODE_LINK:
+                os.symlink(repo[entry.id].data, path)
+            else:
+                with open(path, 'wb') as stream:
+                    stream.write(repo[entry.id].data)
+                if entry.filemode == pygit2.GIT_FILEMODE_BLOB_EXECUTABLE:
+                    os.chmod(path, 0o755)
+
+    def get_size(self, path):
+        size = 0
+        for root, dirs, files in os.walk(path):
+            for each_file in files:
+                try:
+                    size += os.lstat(os.path.join(root, each_file)).st_size
+                except OSError:
+                    continue
+        return size
+
+    def evict(self, keep=None):
+        """
+        Remove least recently used mirrors until the cache fits its budget.
+
+        Mirrors currently locked by another process are never evicted.
+        """
+        mirrors = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not name.endswith('.git') or not os.path.isdir(path):
+                continue
+            mirrors.append((os.stat(path).st_mtime, path, self.get_size(path)))
+        total = sum(size for _, _, size in mirrors)
+        for _, path, size in sorted(mirrors):
+            if total <= self.budget:
+                break
+            if path == keep:
+                continue
+            try:
+                with self.lock(path, blocking=False):
+                    logger.info('Evicting mirror %s', path)
+                    shutil.rmtree(path)
+            except BlockingIOError:
+                continue
+            total -= size
@@ -1,19 +1,45 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import calendar
+import hashlib
+
+from django.core.cache import cache
+from django.db.models import (
+    Count,
+    Max,
+)
+from django.http import (
+    Http404,
+    HttpResponseNotModified,
+)
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page, never_cache
+from django.utils.http import (
+    http_date,
+    parse_http_date_safe,
+)
+from django.views.decorators.cache import never_cache
 
+from rest_framework import status
 from rest_framework.decorators import detail_route
 from rest_framework.response import Response
 
-from django_fsm import FSMField
+from django_fsm import (
+    FSMField,
+    can_proceed,
+)
 
+from .clients import RateLimited
 
-def get_state_field_viewset_method(methods, **kwargs):
+
+def get_state_field_viewset_method(field, methods, **kwargs):
     '''
     Create a viewset method for the provided FSM `field` by adding all its
     transition methods as HTTP methods.
+
+    If the viewset sets a `transition_task`, transitions are handed to it and
+    answered with 202 and the task handle instead of running in the request.
     '''
 
     @detail_route(methods=[name.lower() for name in methods], **kwargs)
@@ -21,7 +47,35 @@ def get_state_field_viewset_method(methods, **kwargs):
         object = self.get_object()
         transition_method = getattr(object, request.method.lower())
 
-        transition_method(by=self.request.user)
+        if self.transition_task is not None:
+            if not can_proceed(transition_method):
+                return Response(
+                    {'detail': 'Transition not allowed from the current state.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            task_id, created = self.transition_task().submit(
+                object,
+                field,
+                request.method.lower(),
+                self.request.user
+            )
+            return Response(
+                {
+                    'id': task_id,
+                    'state': 'PENDING',
+                    'result': None,
+                },
+                status=status.HTTP_202_ACCEPTED if created else status.HTTP_409_CONFLICT
+            )
+
+        try:
+            transition_method(by=self.request.user)
+        except RateLimited as excp:
+            return Response(
+                {'detail': 'Github rate limit reached, try again later.'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(excp.retry_after)}
+            )
 
         if self.save_after_transition:
             object.save()
@@ -53,6 +107,7 @@ def get_viewset_transition_action_mixin(model, **kwargs):
 
     class TransitionMixin(metaclass=MetaTransitionMixin):
         save_after_transition = True
+        transition_task = None
 
 
     for field in model._meta.get_fields():
@@ -61,7 +116,7 @@ def get_viewset_transition_action_mixin(model, **kwargs):
             setattr(
                 TransitionMixin,
                 field.name,
-                get_state_field_viewset_method(transitions, **kwargs)
+                get_state_field_viewset_method(field.name, transitions, **kwargs)
             )
             methods.update(transitions)
 
@@ -75,15 +130,116 @@ def get_viewset_transition_action_mixin(model, **kwargs):
 
 
 class CacheMixin(object):
-    cache_timeout = 60
+    '''
+    Cache small responses under a key derived from the version of the content
+    they were rendered from.
+
+    Views return `None` from `get_cache_key` for responses which must not be
+    cached. As a new build changes the key, cached responses never go stale
+    and a long timeout is safe. Responses larger than `cache_max_size` bypass
+    the cache.
+    '''
+    cache_timeout = 24 * 60 * 60
+    cache_max_size = 512 * 1024
 
     def get_cache_timeout(self):
         return self.cache_timeout
 
-    def dispatch(self, *args, **kwargs):
-        response = super(CacheMixin, self).dispatch
-        decorator = cache_page(self.get_cache_timeout())
-        return decorator(response)(*args, **kwargs)
+    def get_cache_key(self):
+        return None
+
+    def get_cached_response(self):
+        key = self.get_cache_key()
+        if key is None:
+            return None
+        return cache.get(key)
+
+    def cache_response(self, response):
+        key = self.get_cache_key()
+        if key is None or response.streaming or response.status_code != 200:
+            return response
+        if len(response.content) > self.cache_max_size:
+            return response
+        cache.set(key, response, self.get_cache_timeout())
+        return response
+
+
+class ConditionalMixin(object):
+    '''
+    Answer conditional GET requests on list and detail endpoints with 304
+    before any serialization takes place.
+
+    The validators are derived from the number of rows matched and the
+    latest value of each field in `conditional_fields`, which is cheap to
+    aggregate and changes whenever a row is added, removed or saved. Detail
+    requests for rows that do not exist are never answered with 304.
+    '''
+    conditional_fields = ('modified',)
+
+    def get_validators(self, queryset):
+        '''
+        Return the ETag, the last modification timestamp and the number of
+        rows of `queryset`.
+        '''
+        aggregates = {'count': Count('pk')}
+        for index, field in enumerate(self.conditional_fields):
+            aggregates['modified{}'.format(index)] = Max(field)
+        result = queryset.aggregate(**aggregates)
+        timestamps = [
+            result['modified{}'.format(index)]
+            for index in range(len(self.conditional_fields))
+            if result['modified{}'.format(index)]
+        ]
+        last_modified = None
+        if timestamps:
+            last_modified = calendar.timegm(max(timestamps).utctimetuple())
+        digest = hashlib.sha1('{}:{}:{}:{}'.format(
+            self.request.user.pk,
+            self.request.get_full_path(),
+            result['count'],
+            ','.join(timestamp.isoformat() for timestamp in timestamps)
+        ).encode('utf-8'))
+        return '"{}"'.format(digest.hexdigest()), last_modified, result['count']
+
+    def is_not_modified(self, etag, last_modified):
+        header = self.request.META.get('HTTP_IF_NONE_MATCH')
+        if header:
+            etags = [value.strip() for value in header.split(',')]
+            return '*' in etags or etag in etags
+        since = parse_http_date_safe(self.request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return bool(since and last_modified and last_modified <= since)
+
+    def respond_conditionally(self, queryset, view, request, *args, detail=False, **kwargs):
+        etag, last_modified, count = self.get_validators(queryset)
+        # A missing object is never "not modified", even for `If-None-Match: *`.
+        if (count or not detail) and self.is_not_modified(etag, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        view = super(ConditionalMixin, self).list
+        return self.respond_conditionally(queryset, view, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(
+                **{self.lookup_field: kwargs[lookup]}
+            )
+        except (TypeError, ValueError):
+            raise Http404
+        view = super(ConditionalMixin, self).retrieve
+        return self.respond_conditionally(queryset, view, request, *args, detail=True, **kwargs)
+
 
 class NeverCacheMixin(object):
 
@@ -1,7 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import fnmatch
+import json
 import logging
+import posixpath
 import string
 
 from django.conf import settings
@@ -12,20 +15,22 @@ from django.utils.crypto import get_random_string
 from django.utils.translation import ugettext_lazy as _
 
 from django_extensions.db.fields import (
+    CreationDateTimeField,
     ModificationDateTimeField,
 )
 from django_fsm import (
     FSMField,
     transition,
 )
-from github import (
-    Github,
-    GithubException,
-)
 from markupfield.fields import MarkupField
 from purl import URL
 from social.apps.django_app.default.models import UserSocialAuth
 
+from .clients import (
+    GithubError,
+    get_client,
+)
+
 logger = logging.getLogger(__name__)
 
 
@@ -33,6 +38,30 @@ def get_secret():
     return ''.join(get_random_string(16, string.ascii_letters + string.digits))
 
 
+def touches(inputs, paths):
+    """
+    Return whether any of the changed `paths` matches the JSON encoded input
+    patterns `inputs` stored on a repository.
+
+    Without a known configuration every change is considered relevant.
+    """
+    if not inputs:
+        return True
+    patterns = json.loads(inputs)
+    for path in paths:
+        path = posixpath.normpath(path)
+        if path == '.hovercraft.yml':
+            return True
+        prefixes = [path]
+        while '/' in prefixes[-1]:
+            prefixes.append(posixpath.dirname(prefixes[-1]))
+        for pattern in patterns:
+            variants = set([pattern, pattern.replace('**/', '')])
+            if any(fnmatch.fnmatchcase(prefix, variant) for prefix in prefixes for variant in variants):
+                return True
+    return False
+
+
 class Repository(models.Model):
     site = models.ForeignKey(Site, on_delete=models.CASCADE)
     github = models.PositiveIntegerField(
@@ -71,11 +100,28 @@ class Repository(models.Model):
     fork = models.BooleanField(
         default=False
     )
+    inputs = models.TextField(
+        blank=True,
+        default='',
+        verbose_name=_('Presentation inputs from last known configuration')
+    )
 
     class Meta(object):
         ordering = [
             'name',
         ]
+        index_together = [
+            ('site', 'user', 'name'),
+            ('site', 'user', 'state'),
+        ]
+
+    def save_inputs(self, patterns):
+        """
+        Store the source and asset patterns of the current configuration
+        without touching any other field.
+        """
+        self.inputs = json.dumps(sorted(set(patterns)))
+        Repository.objects.filter(pk=self.pk).update(inputs=self.inputs)
 
     @transition(field=state, source='inactive', target='active')
     def activate(self, *args, **kwargs):
@@ -89,10 +135,10 @@ class Repository(models.Model):
         except UserSocialAuth.DoesNotExists:
             logger.error('No social auth provider for Github found on user')
             return
-        github = Github(provider.access_token)
+        github = get_client(provider.access_token)
         try:
-            repo = github.get_user().get_repo(self.name)
-        except GithubException:
+            repo = github.get_repo(self.name)
+        except GithubError:
             logger.error('Could not find repository')
             return
         url = URL(
@@ -101,7 +147,8 @@ class Repository(models.Model):
             path=reverse('qraz:webhook', kwargs={'username': self.user.username, 'repository': self.name})
         )
         try:
-            hook = repo.create_hook(
+            hook = github.create_hook(
+                repo,
                 'web',
                 {
                     'url': url.as_string(),
@@ -111,10 +158,10 @@ class Repository(models.Model):
                 events=['push'],
                 active=True
             )
-        except GithubException as excp:
+        except GithubError as excp:
             logger.error('Could not create webhook: %s', excp)
             return
-        self.hook = hook.id
+        self.hook = hook['id']
 
     @transition(field=state, source='*', target='inactive')
     def deactivate(self, *args, **kwargs):
@@ -129,16 +176,15 @@ class Repository(models.Model):
             except UserSocialAuth.DoesNotExists:
                 logger.error('No social auth provider for Github found on user')
                 raise
-            github = Github(provider.access_token)
+            github = get_client(provider.access_token)
             try:
-                repo = github.get_user().get_repo(self.name)
-            except GithubException:
+                repo = github.get_repo(self.name)
+            except GithubError:
                 logger.error('Could not find repository')
                 raise
             try:
-                hook = repo.get_hook(self.hook)
-                hook.delete()
-            except GithubException as excp:
+                github.delete_hook(repo, self.hook)
+            except GithubError as excp:
                 logger.error('Could not remove webhook: %s', excp)
         self.hook = None
 
@@ -154,6 +200,17 @@ class Presentation(models.Model):
     modified = ModificationDateTimeField(
         verbose_name=_('Last modified')
     )
+    manifest = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        verbose_name=_('Digest of last build manifest')
+    )
+
+    class Meta(object):
+        index_together = [
+            ('repository', 'name'),
+        ]
 
     @property
     def fullname(self):
@@ -172,3 +229,43 @@ class Presentation(models.Model):
             path=reverse('qraz:download', kwargs=kwargs)
         )
         return url.as_string()
+
+
+class Event(models.Model):
+    """
+    Journal entry of a webhook delivery waiting to be dispatched to Celery.
+    """
+    delivery = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name=_('Github delivery ID')
+    )
+    repository = models.ForeignKey(
+        Repository,
+        on_delete=models.CASCADE
+    )
+    head = models.CharField(
+        max_length=40,
+        blank=True,
+        default='',
+        verbose_name=_('Head commit to build')
+    )
+    received = CreationDateTimeField(
+        verbose_name=_('Received')
+    )
+    dispatched = models.DateTimeField(
+        null=True,
+        db_index=True,
+        verbose_name=_('Dispatched')
+    )
+    task = models.CharField(
+        max_length=36,
+        blank=True,
+        default='',
+        verbose_name=_('ID of build task')
+    )
+
+    class Meta(object):
+        ordering = [
+            'pk',
+        ]
@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from rest_framework.pagination import CursorPagination
+
+
+class RepositoryPagination(CursorPagination):
+    """
+    Page through repositories by name, backed by the (site, user, name)
+    index.
+    """
+    page_size = 100
+    ordering = ('name', 'pk')
+
+
+class PresentationPagination(CursorPagination):
+    """
+    Page through presentations by primary key, which stays stable while
+    repositories are built.
+    """
+    page_size = 100
+    ordering = ('pk',)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import logging
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from celery import (
+    current_app,
+    states,
+)
+from celery.utils import uuid
+from kombu import (
+    Exchange,
+    Queue,
+)
+
+logger = logging.getLogger(__name__)
+
+# Transient events are routed to subscribers by task ID.
+exchange = Exchange(
+    'qraz.progress',
+    type='direct',
+    durable=False,
+    delivery_mode='transient'
+)
+
+
+# Streams hold a web server thread each, so only a few may be open per
+# process at once.
+streams = threading.BoundedSemaphore(settings.TASK_PROGRESS_MAX_STREAMS)
+
+
+def get_key(task_id):
+    return 'qraz:progress:{}'.format(task_id)
+
+
+def get_owner_key(task_id):
+    return 'qraz:progress:owner:{}'.format(task_id)
+
+
+def register(task_id, user_pk):
+    """
+    Record the user allowed to follow the progress of `task_id`.
+    """
+    cache.set(get_owner_key(task_id), user_pk, settings.TASK_PROGRESS_TIMEOUT)
+
+
+def get_owner(task_id):
+    return cache.get(get_owner_key(task_id))
+
+
+def get_latest(task_id):
+    """
+    Return the latest event published for `task_id`.
+    """
+    return cache.get(get_key(task_id)) or {
+        'id': task_id,
+        'state': states.PENDING,
+        'result': None,
+    }
+
+
+def publish(task_id, state, result=None):
+    """
+    Publish a progress event for the task `task_id`.
+
+    The latest event of each task is also kept in the cache, so subscribers
+    joining late start with the current state instead of waiting for the
+    next event.
+    """
+    event = {
+        'id': task_id,
+        'state': state,
+        'result': result,
+    }
+    cache.set(get_key(task_id), event, settings.TASK_PROGRESS_TIMEOUT)
+    try:
+        with current_app.producer_or_acquire() as producer:
+            producer.publish(
+                event,
+                exchange=exchange,
+                routing_key=task_id,
+                declare=[exchange],
+                serializer='json'
+            )
+    except (OSError, socket.error) as excp:
+        logger.warn('Could not publish progress of %s: %s', task_id, excp)
+
+
+def subscribe(task_id, timeout=None):
+    """
+    Yield the progress events of the task `task_id` until it is ready or
+    `timeout` seconds have passed.
+
+    `None` is yielded every `TASK_PROGRESS_HEARTBEAT` seconds without an
+    event, so callers can keep their connection alive.
+    """
+    if timeout is None:
+        timeout = settings.TASK_PROGRESS_STREAM_TIMEOUT
+    events = collections.deque()
+
+    def receive(body, message):
+        events.append(body)
+
+    queue = Queue(
+        'qraz.progress.{}'.format(uuid()),
+        exchange=exchange,
+        routing_key=task_id,
+        durable=False,
+        exclusive=True,
+        auto_delete=True
+    )
+    deadline = time.monotonic() + timeout
+    with current_app.connection() as connection:
+        with connection.Consumer(queue, callbacks=[receive], accept=['json'], no_ack=True):
+            # Subscribed before looking at the cache, so nothing is missed.
+            events.append(get_latest(task_id))
+            while time.monotonic() < deadline:
+                while events:
+                    event = events.popleft()
+                    yield event
+                    if event['state'] in states.READY_STATES:
+                        return
+                try:
+                    connection.drain_events(timeout=settings.TASK_PROGRESS_HEARTBEAT)
+                except socket.timeout:
+                    yield None
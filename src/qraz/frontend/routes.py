@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import contextlib
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+)
+from django.dispatch import receiver
+
+from .models import (
+    Repository,
+    Presentation,
+)
+
+
+class RouteIndex(object):
+    """
+    Map `(site, username, repository, presentation)` routes to presentation
+    primary keys without hitting the database for every request.
+
+    Lookups are answered from a small per process dictionary whose entries
+    expire after `ROUTE_INDEX_TTL` seconds, then from the shared cache. The
+    shared entries of a user are invalidated by changing the user's
+    generation, which happens whenever presentations are created or deleted
+    or a repository changes.
+    """
+
+    def __init__(self):
+        self.local = {}
+        self.lock = threading.Lock()
+
+    def get_generation_key(self, site_id, username):
+        return 'qraz:route:generation:{}:{}'.format(site_id, username)
+
+    def get_cache_key(self, generation, route):
+        digest = hashlib.sha1(repr(route).encode('utf-8')).hexdigest()
+        return 'qraz:route:{}:{}'.format(generation, digest)
+
+    def lookup(self, site_id, username, repository, presentation):
+        """
+        Return the primary key of the presentation or `None` if there is
+        no such presentation.
+        """
+        route = (site_id, username, repository, presentation)
+        now = time.monotonic()
+        entry = self.local.get(route)
+        if entry and entry[1] > now:
+            return entry[0]
+        generation_key = self.get_generation_key(site_id, username)
+        generation = cache.get(generation_key)
+        if generation is None:
+            generation = uuid.uuid4().hex
+            if not cache.add(generation_key, generation, None):
+                generation = cache.get(generation_key)
+        key = self.get_cache_key(generation, route)
+        pk = cache.get(key)
+        if pk is None:
+            pk = Presentation.objects.filter(
+                name=presentation,
+                repository__name=repository,
+                repository__user__username=username,
+                repository__site_id=site_id
+            ).values_list('pk', flat=True).first() or 0
+            cache.set(key, pk, None)
+        with self.lock:
+            if len(self.local) >= settings.ROUTE_INDEX_SIZE:
+                self.local.clear()
+            self.local[route] = (pk, now + settings.ROUTE_INDEX_TTL)
+        return pk or None
+
+    def invalidate(self, site_id, username):
+        cache.set(self.get_generation_key(site_id, username), uuid.uuid4().hex, None)
+        with self.lock:
+            for route in [route for route in self.local if route[:2] == (site_id, username)]:
+                del self.local[route]
+
+
+class HookIndex(object):
+    """
+    Map `(username, repository)` to the fields webhook requests need,
+    without loading the repository model.
+
+    Entries are dropped whenever the repository is saved or deleted, missing
+    repositories are only remembered for `ROUTE_INDEX_TTL` seconds as
+    synchronization creates them in bulk without sending signals.
+    """
+    fields = ('pk', 'secret', 'state', 'inputs')
+
+    def get_cache_key(self, username, repository):
+        digest = hashlib.sha1(repr((username, repository)).encode('utf-8')).hexdigest()
+        return 'qraz:hook:{}'.format(digest)
+
+    def lookup(self, username, repository):
+        """
+        Return a dictionary of `fields` or `None` if there is no such
+        repository.
+        """
+        key = self.get_cache_key(username, repository)
+        entry = cache.get(key)
+        if entry is None:
+            values = Repository.objects.filter(
+                name=repository,
+                user__username=username
+            ).values_list(*self.fields).first()
+            entry = dict(zip(self.fields, values)) if values else {}
+            cache.set(key, entry, None if entry else settings.ROUTE_INDEX_TTL)
+        return entry or None
+
+    def invalidate(self, username, repository):
+        cache.delete(self.get_cache_key(username, repository))
+
+    def invalidate_many(self, username, repositories):
+        cache.delete_many([
+            self.get_cache_key(username, repository)
+            for repository in repositories
+        ])
+
+
+index = RouteIndex()
+hooks = HookIndex()
+state = threading.local()
+
+
+@contextlib.contextmanager
+def suspended():
+    """
+    Keep the signal receivers below from invalidating anything on this
+    thread, for bulk operations that invalidate once for all rows instead
+    of one or more queries per row.
+    """
+    state.suspended = True
+    try:
+        yield
+    finally:
+        state.suspended = False
+
+
+def is_suspended():
+    return getattr(state, 'suspended', False)
+
+
+def invalidate_repository(repository_id):
+    route = Repository.objects.filter(pk=repository_id).values_list('site_id', 'user__username').first()
+    if route:
+        index.invalidate(*route)
+
+
+@receiver(post_save, sender=Presentation)
+def presentation_saved(sender, instance, created, **kwargs):
+    if is_suspended():
+        return
+    # Routes of existing presentations never change.
+    if created:
+        invalidate_repository(instance.repository_id)
+
+
+@receiver(post_delete, sender=Presentation)
+def presentation_deleted(sender, instance, **kwargs):
+    if is_suspended():
+        return
+    invalidate_repository(instance.repository_id)
+
+
+@receiver(post_save, sender=Repository)
+def repository_saved(sender, instance, created, **kwargs):
+    if is_suspended():
+        return
+    hooks.invalidate(instance.user.username, instance.name)
+    if not created:
+        index.invalidate(instance.site_id, instance.user.username)
+
+
+@receiver(post_delete, sender=Repository)
+def repository_deleted(sender, instance, **kwargs):
+    if is_suspended():
+        return
+    hooks.invalidate(instance.user.username, instance.name)
+    index.invalidate(instance.site_id, instance.user.username)
@@ -7,17 +7,51 @@ from rest_framework import serializers
 from . import models
 
 
-class RepositorySerializer(serializers.HyperlinkedModelSerializer):
+class FieldsMixin(object):
+    """
+    Restrict the serialized fields to those named in the comma separated
+    `fields` query parameter of the request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(FieldsMixin, self).__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or not request.query_params.get('fields'):
+            return
+        wanted = set(request.query_params['fields'].split(','))
+        for name in set(self.fields) - wanted:
+            self.fields.pop(name)
+
+
+class RepositorySerializer(FieldsMixin, serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = models.Repository
         fields = ('id', 'name', 'state')
 
 
-class PresentationSerializer(serializers.HyperlinkedModelSerializer):
+class PresentationSerializer(FieldsMixin, serializers.HyperlinkedModelSerializer):
     fullname = serializers.ReadOnlyField()
     url = serializers.ReadOnlyField()
 
     class Meta:
         model = models.Presentation
         fields = ('id', 'fullname', 'url')
+
+
+class BulkTransitionSerializer(serializers.Serializer):
+    max_ids = 1000
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField()
+    )
+    state = serializers.ChoiceField(
+        choices=('active', 'inactive')
+    )
+
+    def validate_ids(self, value):
+        if not value:
+            raise serializers.ValidationError('No repositories given.')
+        if len(value) > self.max_ids:
+            raise serializers.ValidationError('At most {} repositories at once.'.format(self.max_ids))
+        return sorted(set(value))
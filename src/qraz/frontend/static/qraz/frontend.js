@@ -22,6 +22,29 @@ angular.module(
     }
   ]
 )
+.factory(
+  'fetchAll',
+  [
+    '$http',
+    function(
+      $http
+    ) {
+      // Collect the results of all pages of a paginated API listing.
+      return function(url) {
+        var items = [];
+        (function load(url) {
+          $http.get(url).then(function(response) {
+            Array.prototype.push.apply(items, response.data.results);
+            if (response.data.next) {
+              load(response.data.next);
+            }
+          });
+        })(url);
+        return items;
+      };
+    }
+  ]
+)
 .factory(
   'Presentation',
   [
@@ -83,13 +106,13 @@ angular.module(
 .controller(
   'PresentationsController',
   [
-    'Presentation',
+    'fetchAll',
     '$scope',
     function(
-      Presentation,
+      fetchAll,
       $scope
     ) {
-      $scope.presentations = Presentation.query();
+      $scope.presentations = fetchAll('/api/presentations/?fields=fullname,url');
     }
   ]
 )
@@ -98,11 +121,15 @@ angular.module(
   [
     'Repository',
     'Synchronization',
+    'fetchAll',
+    '$http',
     '$scope',
     '$timeout',
     function(
       Repository,
       Synchronization,
+      fetchAll,
+      $http,
       $scope,
       $timeout
     ) {
@@ -114,23 +141,32 @@ angular.module(
           $scope.syncProgress = sync.result.total / 100 * sync.result.current;
         },
         'SUCCESS': function(sync) {
-          $scope.repositories = Repository.query();
+          $scope.repositories = fetchAll('/api/repositories/');
+          $scope.syncActive = false;
+        },
+        'FAILURE': function(sync) {
           $scope.syncActive = false;
         },
       };
+      stateMap['REVOKED'] = stateMap['FAILURE'];
       $scope.syncActive = false;
-      $scope.repositories = Repository.query();
+      $scope.repositories = fetchAll('/api/repositories/');
       $scope.syncGithub = function() {
         $scope.sync = new Synchronization();
         $scope.sync.$save(function() {
-          (function tick() {
-            $scope.sync.$get(function(){
-              if ($scope.sync.state !== 'SUCCESS') {
-                $timeout(tick, 2000);
-              }
-              stateMap[$scope.sync.state]($scope.sync);
-            });
-          })();
+          stateMap[$scope.sync.state]($scope.sync);
+          var source = new EventSource('/events/' + $scope.sync.id);
+          source.addEventListener('progress', function(message) {
+            var sync = JSON.parse(message.data);
+            if (sync.state === 'SUCCESS' || sync.state === 'FAILURE' || sync.state === 'REVOKED') {
+              source.close();
+            }
+            if (stateMap[sync.state]) {
+              $scope.$apply(function() {
+                stateMap[sync.state](sync);
+              });
+            }
+          });
         });
       };
       $scope.toggleRepository = function(repo) {
@@ -141,9 +177,28 @@ angular.module(
         } else {
           result = Repository.deactivate({id: repo.id});
         }
-        result.$promise.then(function(data) {
-          angular.extend(repo, data);
-        repo._working = false;
+        result.$promise.then(function(task) {
+          // The transition runs in a task, poll it until it is done instead
+          // of holding an event stream open for every repository.
+          (function tick() {
+            $http.get('/events/' + task.id, {
+              headers: {Accept: 'application/json'}
+            }).then(function(response) {
+              var event = response.data;
+              if (event.state === 'PENDING' || event.state === 'PROGRESS') {
+                $timeout(tick, 1000);
+                return;
+              }
+              if (event.result) {
+                repo.state = event.result.state;
+              }
+              repo._working = false;
+            }, function() {
+              repo._working = false;
+            });
+          })();
+        }, function() {
+          repo._working = false;
         });
       }
     }
@@ -2,26 +2,57 @@
 # -*- coding: utf-8 -*-
 
 import io
-import glob
 import os
-import shutil
-import subprocess
 import tempfile
+import time
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    as_completed,
+)
 
-import pygit2
 import yaml
 
+from django.apps import apps
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.db import (
+    connection,
+    transaction,
+)
+from django.db.models import (
+    BooleanField,
+    Case,
+    CharField,
+    Value,
+    When,
+)
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from celery import Task
-from celery.utils.log import get_task_logger
-from github import (
-    Github,
-    GithubException,
+from celery import (
+    Task,
+    chord,
+    states,
 )
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.utils import uuid
+from celery.utils.log import get_task_logger
+from django_fsm import can_proceed
 from social.apps.django_app.default.models import UserSocialAuth
 
+from . import (
+    builds,
+    mirrors,
+    progress,
+    routes,
+)
+from .clients import (
+    GithubError,
+    RateLimited,
+    get_client,
+)
 from .models import (
     Repository,
     Presentation,
@@ -30,147 +61,679 @@ from .models import (
 logger = get_task_logger(__name__)
 
 
-class SynchronizationTask(Task):
+class ProgressTask(Task):
+    """
+    Base for tasks publishing their progress to the event stream instead of
+    writing it to the result backend.
+    """
+    abstract = True
+
+    def progress(self, current, total, force=False):
+        """
+        Publish a progress event, at most once per `TASK_PROGRESS_INTERVAL`
+        seconds unless forced.
+        """
+        if self.request.called_directly:
+            return
+        now = time.monotonic()
+        if not force and now - getattr(self, 'progress_sent', 0) < settings.TASK_PROGRESS_INTERVAL:
+            return
+        self.progress_sent = now
+        progress.publish(
+            self.request.id,
+            'PROGRESS',
+            {
+                'current': current,
+                'total': total
+            }
+        )
+
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        if status not in states.READY_STATES:
+            return
+        result = retval if status == states.SUCCESS else None
+        progress.publish(task_id, status, result)
+
+
+class SynchronizationTask(ProgressTask):
     ignore_result = False
+    chunk_size = 500
 
-    def run(self, user, site, *args, **kwargs):
+    def run(self, user_pk, site_pk, *args, **kwargs):
+        user = get_user_model().objects.get(pk=user_pk)
+        site = Site.objects.get(pk=site_pk)
         try:
             provider = user.social_auth.get(provider='github')
         except UserSocialAuth.DoesNotExists:
             logger.error('No social auth provider for Github found on user')
             return
-        github = Github(provider.access_token)
+        github = get_client(provider.access_token)
         prior = timezone.now()
-        repos = list(github.get_user().get_repos())
+        self.progress_sent = 0
+        try:
+            repos = github.get_repos()
+        except RateLimited as excp:
+            raise self.retry(exc=excp, countdown=excp.retry_after)
         logger.info('Synchronizing %d repositories for user %s', len(repos), user.username)
-        for i, repo in enumerate(repos):
-            logger.debug('Processing repository: %s (%d/%d)', repo.name, i, len(repos))
-            if not self.request.called_directly:
-                self.update_state(
-                    state='PROGRESS',
-                    meta={
-                        'current': i+1,
-                        'total': len(repos)
-                    }
-                )
-            instance, created = Repository.objects.get_or_create(
+        existing = dict(
+            (github, (pk, name, fork))
+            for github, pk, name, fork in Repository.objects.filter(
                 site=site,
-                user=user,
-                github=repo.id,
-                defaults={
-                    'name': repo.name,
-                    'fork': repo.fork,
-                }
-            )
-            if not created:
-                logger.debug('Updating repository instance: %s', instance.name)
-                instance.save()
+                user=user
+            ).values_list('github', 'pk', 'name', 'fork')
+        )
+        created = []
+        updated = []
+        changed = []
+        renamed = []
+        for repo in repos:
+            if repo['id'] in existing:
+                pk, name, fork = existing[repo['id']]
+                if (name, fork) == (repo['name'], repo['fork']):
+                    updated.append(pk)
+                    continue
+                changed.append((pk, repo['name'], repo['fork']))
+                if name != repo['name']:
+                    renamed.extend([name, repo['name']])
             else:
-                logger.debug('Creating repository instance: %s', instance.name)
+                logger.debug('Creating repository instance: %s', repo['name'])
+                created.append(
+                    Repository(
+                        site=site,
+                        user=user,
+                        github=repo['id'],
+                        name=repo['name'],
+                        fork=repo['fork']
+                    )
+                )
+        logger.debug(
+            'Updating %d, changing %d and creating %d repository instances',
+            len(updated),
+            len(changed),
+            len(created)
+        )
+        current = 0
+        now = timezone.now()
+        for i in range(0, len(updated), self.chunk_size):
+            chunk = updated[i:i + self.chunk_size]
+            Repository.objects.filter(pk__in=chunk).update(modified=now)
+            current += len(chunk)
+            self.progress(current, len(repos))
+        for i in range(0, len(changed), self.chunk_size):
+            chunk = changed[i:i + self.chunk_size]
+            Repository.objects.filter(pk__in=[pk for pk, name, fork in chunk]).update(
+                name=Case(
+                    *[When(pk=pk, then=Value(name)) for pk, name, fork in chunk],
+                    output_field=CharField()
+                ),
+                fork=Case(
+                    *[When(pk=pk, then=Value(fork)) for pk, name, fork in chunk],
+                    output_field=BooleanField()
+                ),
+                modified=now
+            )
+            current += len(chunk)
+            self.progress(current, len(repos))
+        if renamed:
+            # Updates bypass the signal receivers maintaining the indexes.
+            routes.index.invalidate(site.pk, user.username)
+            routes.hooks.invalidate_many(user.username, renamed)
+        for i in range(0, len(created), self.chunk_size):
+            chunk = created[i:i + self.chunk_size]
+            Repository.objects.bulk_create(chunk)
+            current += len(chunk)
+            self.progress(current, len(repos))
+        self.progress(current, len(repos), force=True)
         logger.info('Removing old repositories')
-        for stale in Repository.objects.filter(site=site, user=user, modified__lt=prior):
-            stale.deactivate()
-            stale.delete()
+        self.cleanup(github, site, user, Repository.objects.filter(site=site, user=user, modified__lt=prior))
 
+    def remove_hook(self, github, name, hook):
+        """
+        Remove a webhook from Github, returning `False` if that has to be
+        retried later.
+        """
+        try:
+            github.delete_hook(github.get_repo(name), hook)
+        except RateLimited:
+            logger.warn('Rate limited, keeping repository %s for the next synchronization', name)
+            return False
+        except GithubError as excp:
+            # The repository itself is gone or the hook was removed by hand.
+            logger.debug('Could not remove webhook of %s: %s', name, excp)
+        return True
+
+    def cleanup(self, github, site, user, stale):
+        """
+        Delete stale repositories chunk by chunk, together with their
+        webhooks, built presentations and mirrors.
+
+        Only repositories with a webhook cause Github API calls, which run
+        concurrently. The route and hook indexes are invalidated once per
+        chunk instead of by the signal receivers for every deleted row.
+        """
+        last = 0
+        removed = False
+        while True:
+            chunk = list(
+                stale.filter(pk__gt=last).order_by('pk').values_list('pk', 'name', 'hook')[:self.chunk_size]
+            )
+            if not chunk:
+                break
+            last = chunk[-1][0]
+            pks = [pk for pk, name, hook in chunk if not hook]
+            with ThreadPoolExecutor(max_workers=settings.GITHUB_HOOK_CONCURRENCY) as executor:
+                futures = dict(
+                    (executor.submit(self.remove_hook, github, name, hook), pk)
+                    for pk, name, hook in chunk
+                    if hook
+                )
+                for future in as_completed(futures):
+                    if future.result():
+                        pks.append(futures[future])
+            presentations = list(
+                Presentation.objects.filter(repository_id__in=pks).values_list('pk', flat=True)
+            )
+            with routes.suspended():
+                Repository.objects.filter(pk__in=pks).delete()
+            deleted = set(pks)
+            routes.index.invalidate(site.pk, user.username)
+            routes.hooks.invalidate_many(user.username, [name for pk, name, hook in chunk if pk in deleted])
+            for pk in presentations:
+                builds.remove(pk)
+            for pk in pks:
+                mirrors.MirrorCache().remove(pk)
+            removed = removed or bool(presentations)
+        if removed:
+            builds.collect_blobs()
+
+
+def snapshot(instance):
+    """
+    Return the values of the concrete fields of `instance`.
+    """
+    return dict(
+        (each.attname, each.value_from_object(instance))
+        for each in instance._meta.concrete_fields
+    )
+
+
+def commit_transition(instance, field, expected, before):
+    """
+    Save the fields a transition changed on `instance` since the
+    `before` snapshot, unless `field` no longer holds the `expected` state
+    in the database.
+
+    Returns the state found in the database while it was locked.
+    """
+    model = type(instance)
+    changed = [
+        each.name
+        for each in model._meta.concrete_fields
+        if each.value_from_object(instance) != before[each.attname] or getattr(each, 'auto_now', False)
+    ]
+    with transaction.atomic():
+        current = model.objects.select_for_update().filter(pk=instance.pk).values_list(field, flat=True).first()
+        if current == expected:
+            instance.save(update_fields=changed)
+    return current
 
-class ActivationTask(Task):
+
+class TransitionTask(ProgressTask):
+    """
+    Run an FSM transition requested through the API on a worker.
+
+    The state seen by the request is passed along and the transition is
+    only committed if the state is still the same, so concurrent transitions
+    of one instance do not clobber each other. Side effects of a transition
+    that loses this race are not undone.
+    """
     ignore_result = False
 
-    def run(self, repository, *args, **kwargs):
+    @staticmethod
+    def get_key(label, pk):
+        return 'qraz:transition:{}:{}'.format(label, pk)
+
+    def submit(self, instance, field, transition, user):
+        """
+        Record a pending transition of `instance` and enqueue it.
+
+        Returns the ID of the task and whether it was created, or the ID of
+        the task already pending for the instance.
+        """
+        label = instance._meta.label
+        key = self.get_key(label, instance.pk)
+        task_id = uuid()
+        if not cache.add(key, task_id, settings.TRANSITION_TIMEOUT):
+            return cache.get(key), False
+        progress.register(task_id, user.pk)
         try:
-            repository.activate()
-        except:
-            logger.warn('Repository activation failed: %s', repository.name)
-            return False
-        logger.debug('Repository activated: %s', repository.name)
-        repository.save()
-        return True
+            self.apply_async(
+                (label, instance.pk, field, transition, getattr(instance, field), user.pk),
+                task_id=task_id
+            )
+        except Exception:
+            cache.delete(key)
+            raise
+        return task_id, True
 
+    def after_return(self, status, retval, task_id, args, kwargs, einfo):
+        super(TransitionTask, self).after_return(status, retval, task_id, args, kwargs, einfo)
+        if status in states.READY_STATES:
+            cache.delete(self.get_key(args[0], args[1]))
 
-class BuildTask(Task):
-    ignore_result = True
+    def run(self, label, pk, field, transition, expected, user_pk, *args, **kwargs):
+        model = apps.get_model(label)
+        instance = model.objects.get(pk=pk)
+        result = {
+            'id': pk,
+            'state': getattr(instance, field),
+            'success': False,
+            'error': None,
+        }
+        if result['state'] != expected:
+            result['error'] = 'conflict'
+            return result
+        before = snapshot(instance)
+        try:
+            getattr(instance, transition)(by=get_user_model().objects.get(pk=user_pk))
+        except RateLimited as excp:
+            raise self.retry(exc=excp, countdown=excp.retry_after)
+        current = commit_transition(instance, field, expected, before)
+        if current != expected:
+            logger.warn('Transition %s of %s %s lost against a concurrent one', transition, label, pk)
+            result['state'] = current
+            result['error'] = 'conflict'
+            return result
+        result['state'] = getattr(instance, field)
+        result['success'] = True
+        return result
 
-    def build(self, copy, presentation, assets, *args, **kwargs):
-        subprocess.call(
-            [
-                '/usr/bin/hovercraft',
-                os.path.join(copy, presentation.path),
-                os.path.join(
-                    settings.HOVERCRAFT_ROOT,
-                    str(presentation.pk)
-                )
-            ]
-        )
-        for asset in assets:
-            asset_glob = os.path.realpath(
-                os.path.abspath(os.path.join(copy, asset))
+
+class BulkTransitionTask(ProgressTask):
+    """
+    Activate or deactivate many repositories of a user at once.
+
+    The Github hook calls of the transitions run concurrently on up to
+    `GITHUB_HOOK_CONCURRENCY` threads, the repositories are saved on the
+    task's thread once their transition finished. Like `TransitionTask`,
+    each repository is locked against other pending transitions and only
+    saved if its state did not change concurrently. Transitions still queued
+    when the soft time limit is hit are cancelled and reported as errors,
+    as are repositories that do not exist or belong to another user.
+    """
+    ignore_result = False
+    transitions = {
+        'active': 'activate',
+        'inactive': 'deactivate',
+    }
+
+    def transition(self, repository, name):
+        try:
+            getattr(repository, name)()
+        finally:
+            # Worker threads open their own database connections.
+            connection.close()
+
+    def report(self, repository, future, name, target, before):
+        """
+        Save `repository` if the transition run by `future` succeeded and
+        return its result.
+        """
+        error = None
+        try:
+            future.result()
+        except RateLimited as excp:
+            error = 'rate limited, retry in {}s'.format(excp.retry_after)
+        except Exception as excp:
+            logger.warn('Transition %s failed for %s: %s', name, repository.name, excp)
+            error = str(excp)
+        state = repository.state
+        if error is None:
+            current = commit_transition(repository, 'state', before['state'], before)
+            if current != before['state']:
+                # The state field is protected, the instance keeps the state
+                # of the lost transition.
+                logger.warn('Transition %s of %s lost against a concurrent one', name, repository.name)
+                state = current
+                error = 'conflict'
+        return {
+            'id': repository.pk,
+            'state': state,
+            'success': error is None and state == target and (
+                target != 'active' or repository.hook is not None
+            ),
+            'error': error,
+        }
+
+    def run(self, user_pk, site_pk, repository_pks, target, *args, **kwargs):
+        name = self.transitions[target]
+        repositories = list(
+            Repository.objects.select_related('user', 'site').filter(
+                user_id=user_pk,
+                site_id=site_pk,
+                pk__in=repository_pks
             )
-            if not os.path.commonpath([copy, asset_glob]).startswith(copy):
-                logger.warn("Malicious asset: %s", asset)
-                continue
-            for asset_source in glob.glob(asset_glob, recursive=True):
-                asset_target = os.path.join(
-                    settings.HOVERCRAFT_ROOT,
-                    str(presentation.pk),
-                    os.path.relpath(asset_source, copy)
+        )
+        found = set(repository.pk for repository in repositories)
+        results = [
+            {
+                'id': pk,
+                'state': None,
+                'success': False,
+                'error': 'not found',
+            }
+            for pk in repository_pks
+            if pk not in found
+        ]
+        pending = []
+        locks = []
+        try:
+            for repository in repositories:
+                if repository.state == target or not can_proceed(getattr(repository, name)):
+                    results.append({
+                        'id': repository.pk,
+                        'state': repository.state,
+                        'success': repository.state == target,
+                        'error': None,
+                    })
+                    continue
+                key = TransitionTask.get_key(Repository._meta.label, repository.pk)
+                if not cache.add(key, self.request.id, settings.TRANSITION_TIMEOUT):
+                    results.append({
+                        'id': repository.pk,
+                        'state': repository.state,
+                        'success': False,
+                        'error': 'pending',
+                    })
+                    continue
+                locks.append(key)
+                pending.append((repository, snapshot(repository)))
+            total = len(results) + len(pending)
+            reported = set()
+            with ThreadPoolExecutor(max_workers=settings.GITHUB_HOOK_CONCURRENCY) as executor:
+                futures = dict(
+                    (executor.submit(self.transition, repository, name), (repository, before))
+                    for repository, before in pending
                 )
-                if os.path.isdir(asset_source):
-                    for root, dirs, files in os.walk(asset_source):
-                        rel_path = os.path.relpath(root, asset_source)
-                        dest_dir = os.path.join(asset_target, rel_path)
-                        if not os.path.isdir(dest_dir):
-                            os.makedirs(dest_dir)
-                        for each_file in files:
-                            dest_path = os.path.join(dest_dir, each_file)
-                            shutil.copyfile(os.path.join(root, each_file), dest_path)
+                try:
+                    for future in as_completed(futures):
+                        repository, before = futures[future]
+                        results.append(self.report(repository, future, name, target, before))
+                        reported.add(future)
+                        self.progress(len(results), total)
+                except SoftTimeLimitExceeded:
+                    # Leaving the executor only waits for the running
+                    # transitions once the queued ones are cancelled.
+                    cancelled = len([future for future in futures if future.cancel()])
+                    logger.warn('Time limit exceeded, cancelled %d of %d transitions', cancelled, total)
+            for future, (repository, before) in futures.items():
+                if future in reported:
+                    continue
+                if future.cancelled():
+                    results.append({
+                        'id': repository.pk,
+                        'state': repository.state,
+                        'success': False,
+                        'error': 'timeout',
+                    })
                 else:
-                    shutil.copyfile(asset_source, asset_target)
+                    results.append(self.report(repository, future, name, target, before))
+        finally:
+            cache.delete_many(locks)
+        self.progress(len(results), total, force=True)
+        return results
+
+
+class BuildCoalescer(object):
+    """
+    Coalesce builds of one repository.
+
+    While a build is queued or running, further pushes only mark the
+    repository dirty. Once the build finishes, at most one follow-up build
+    runs against the tip of the default branch, resolved by the worker, so
+    neither out-of-order deliveries nor a push racing `finish()` can
+    publish an older commit over a newer one.
+    """
+
+    def __init__(self, repository_pk):
+        self.repository_pk = repository_pk
+
+    def get_key(self, name):
+        return 'qraz:build:{}:{}'.format(name, self.repository_pk)
+
+    def submit(self, head=None, **options):
+        """
+        Request a build of `head` and return the ID of the build task that
+        will cover it and whether the request was coalesced into it.
+
+        Further `options` are passed on to `apply_async` if a build is
+        started.
+        """
+        timeout = settings.BUILD_COALESCE_TIMEOUT
+        if not cache.add(self.get_key('lock'), True, timeout):
+            cache.set(self.get_key('dirty'), True, timeout)
+            # The running build may have finished in between.
+            if not cache.add(self.get_key('lock'), True, timeout):
+                return cache.get(self.get_key('task')), True
+        # This build covers every push recorded so far.
+        cache.delete(self.get_key('dirty'))
+        return self.start(head, **options), False
+
+    def start(self, head, **options):
+        task_id = uuid()
+        cache.set(self.get_key('task'), task_id, settings.BUILD_COALESCE_TIMEOUT)
+        try:
+            BuildTask().apply_async((self.repository_pk, head or None), task_id=task_id, **options)
+        except Exception:
+            # Do not block the repository until the lock times out.
+            cache.delete(self.get_key('lock'))
+            raise
+        return task_id
+
+    def finish(self):
+        """
+        Release the repository and start a follow-up build if pushes arrived
+        in the meantime.
+        """
+        cache.delete(self.get_key('lock'))
+        if not cache.get(self.get_key('dirty')):
+            return None
+        if not cache.add(self.get_key('lock'), True, settings.BUILD_COALESCE_TIMEOUT):
+            # A push took the lock and builds the latest head itself.
+            return None
+        cache.delete(self.get_key('dirty'))
+        logger.debug('Starting coalesced build for repository %d', self.repository_pk)
+        return self.start(None)
+
+
+class BuildTask(ProgressTask):
+    """
+    First stage of a build: check out the repository, parse its
+    `.hovercraft.yml` and update the presentations.
+
+    Presentations whose build manifest changed are either built by one
+    `PresentationBuildTask` each, fanned out over the workers and joined by
+    `BuildCleanupTask` in a chord, or, if `HOVERCRAFT_FANOUT` is disabled,
+    concurrently on this worker.
+    """
+    ignore_result = False
+
+    def prepare(self, repository, copy, index):
+        """
+        Create or update all presentations configured in `copy`.
+
+        `index` maps the paths in `copy` to their git blob IDs. Returns the
+        results for presentations that are up to date and a list of
+        `(presentation, manifest, assets)` tuples that need building.
+        """
+        results = []
+        pending = []
+        inputs = []
+        config_file = os.path.join(copy, '.hovercraft.yml')
+        if not os.access(config_file, os.R_OK):
+            repository.save_inputs(inputs)
+            return results, pending
+        with io.open(config_file, 'r', encoding='utf-8') as stream:
+            config = yaml.load(stream)
+        version = builds.get_hovercraft_version()
+        for presentation, data in config.items():
+            source = data.get('source', '{}.rst'.format(presentation,))
+            inputs.append(os.path.normpath(source))
+            inputs.extend(os.path.normpath(asset) for asset in data.get('assets', []))
+            source_path = os.path.realpath(os.path.abspath(os.path.join(copy, source)))
+            if not os.path.isfile(source_path):
+                logger.warn('Source not found: %s', source)
+                continue
+            if not os.path.commonpath([copy, source_path]).startswith(copy):
+                logger.warn('Malicious source: %s', source)
+                continue
+            resources = builds.get_resources(copy, source_path)
+            inputs.extend(resources)
+            instance, created = Presentation.objects.get_or_create(
+                repository=repository,
+                name=presentation,
+                defaults={
+                    'path': source,
+                }
+            )
+            manifest = builds.hash_data(
+                builds.get_manifest(copy, source_path, data, version, index, resources)
+            )
+            instance.path = source
+            instance.save()
+            if instance.manifest == manifest and os.path.isdir(builds.get_target(instance.pk)):
+                logger.debug('Presentation unchanged: %s', instance.fullname)
+                results.append({
+                    'name': instance.name,
+                    'built': False,
+                    'success': True,
+                })
+                continue
+            pending.append((instance, manifest, data.get('assets', [])))
+        repository.save_inputs(inputs)
+        return results, pending
 
-    def run(self, repository, *args, **kwargs):
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        BuildCoalescer(args[0]).finish()
+
+    def run(self, repository_pk, head=None, *args, **kwargs):
+        try:
+            repository = Repository.objects.select_related('user').get(pk=repository_pk)
+        except Repository.DoesNotExist:
+            logger.warn('Repository vanished before build: %d', repository_pk)
+            BuildCoalescer(repository_pk).finish()
+            return False
         try:
             provider = repository.user.social_auth.get(provider='github')
         except UserSocialAuth.DoesNotExists:
             logger.error('No social auth provider for Github found on user')
+            BuildCoalescer(repository.pk).finish()
             return False
-        github = Github(provider.access_token)
+        github = get_client(provider.access_token)
         try:
-            repo = github.get_user().get_repo(repository.name)
-        except GithubException:
+            repo = github.get_repo(repository.name)
+        except RateLimited as excp:
+            raise self.retry(exc=excp, countdown=excp.retry_after)
+        except GithubError:
             logger.error('Could not find repository')
+            BuildCoalescer(repository.pk).finish()
             return False
-        prior = timezone.now()
+        prior = timezone.now().isoformat()
+        revision = head or 'refs/heads/{}'.format(repo['default_branch'])
         with tempfile.TemporaryDirectory() as copy:
-            pygit2.clone_repository(repo.git_url, copy)
-            config_file = os.path.join(copy, '.hovercraft.yml')
-            if os.access(config_file, os.R_OK):
-                with io.open(config_file, 'r', encoding='utf-8') as stream:
-                    config = yaml.load(stream)
-                for presentation in repository.presentation_set.all():
-                    shutil.rmtree(
-                        os.path.join(
-                            settings.HOVERCRAFT_ROOT,
-                            str(presentation.pk)
-                        ),
-                        ignore_errors=True
-                    )
-                for presentation, data in config.items():
-                    source = data.get('source', '{}.rst'.format(presentation,))
-                    source_path = os.path.realpath(os.path.abspath(os.path.join(copy, source)))
-                    if not os.path.isfile(source_path):
-                        logger.warn('Source not found: %s', source)
-                        continue
-                    if not os.path.commonpath([copy, source_path]).startswith(copy):
-                        logger.warn('Malicious source: %s', source)
-                        continue
-                    instance, created = Presentation.objects.get_or_create(
-                        repository=repository,
-                        name=presentation,
-                        defaults={
-                            'path': source,
-                        }
+            index = {}
+            commit = mirrors.MirrorCache().checkout(repository.pk, repo['git_url'], revision, copy, index)
+            results, pending = self.prepare(repository, copy, index)
+            # The recorded inputs decide which pushes trigger builds.
+            routes.hooks.invalidate(repository.user.username, repository.name)
+            total = len(results) + len(pending)
+            self.progress(len(results), total, force=True)
+            if not settings.HOVERCRAFT_FANOUT:
+                with ThreadPoolExecutor(max_workers=settings.HOVERCRAFT_CONCURRENCY) as executor:
+                    futures = dict(
+                        (executor.submit(builds.build, copy, instance, assets, index), (instance, manifest))
+                        for instance, manifest, assets in pending
                     )
-                    if not created:
+                    for future in as_completed(futures):
+                        instance, manifest = futures[future]
+                        result = future.result()
+                        instance.manifest = manifest if result['success'] else ''
                         instance.save()
-                    self.build(copy, instance, data.get('assets', []))
-            Presentation.objects.filter(repository=repository, modified__lt=prior).delete()
+                        results.append(result)
+                        self.progress(len(results), total)
+                return BuildCleanupTask().run(results, repository.pk, prior)
+        if not pending:
+            return BuildCleanupTask().run(results, repository.pk, prior)
+        header = [
+            PresentationBuildTask().si(instance.pk, repo['git_url'], commit, manifest, assets)
+            for instance, manifest, assets in pending
+        ]
+        callback = chord(header)(
+            BuildCleanupTask().s(repository.pk, prior, results)
+        )
+        return callback.id
 
+
+class PresentationBuildTask(Task):
+    """
+    Build a single presentation from `commit`, checked out of the local
+    mirror cache.
+
+    Never fails: a failed header task would keep the chord's
+    `BuildCleanupTask` from running and thereby from releasing the
+    repository's build lock, so every error is turned into a failed result.
+    """
+    ignore_result = False
+
+    def run(self, presentation_pk, url, commit, manifest, assets, *args, **kwargs):
+        try:
+            presentation = Presentation.objects.get(pk=presentation_pk)
+        except Presentation.DoesNotExist:
+            logger.warn('Presentation vanished before build: %d', presentation_pk)
+            return {
+                'name': None,
+                'built': False,
+                'success': False,
+                'error': 'missing',
+            }
+        try:
+            with tempfile.TemporaryDirectory() as copy:
+                index = {}
+                mirrors.MirrorCache().checkout(presentation.repository_id, url, commit, copy, index)
+                result = builds.build(copy, presentation, assets, index)
+        except Exception as excp:
+            logger.exception('Build failed for %s', presentation.name)
+            result = {
+                'name': presentation.name,
+                'built': True,
+                'success': False,
+                'error': str(excp) or excp.__class__.__name__,
+            }
+        presentation.manifest = manifest if result['success'] else ''
+        presentation.save()
+        return result
+
+
+class BuildCleanupTask(ProgressTask):
+    """
+    Final stage of a build: remove presentations no longer configured and
+    collect the per presentation results.
+    """
+    ignore_result = False
+
+    def on_failure(self, exc, task_id, args, kwargs, einfo):
+        BuildCoalescer(args[1]).finish()
+
+    def run(self, results, repository_pk, prior, skipped=None, *args, **kwargs):
+        prior = parse_datetime(prior)
+        stale = Presentation.objects.filter(repository_id=repository_pk, modified__lt=prior)
+        removed = list(stale.values_list('pk', flat=True))
+        stale.delete()
+        for pk in removed:
+            builds.remove(pk)
+        BuildCoalescer(repository_pk).finish()
+        return dict(
+            (result['name'], result)
+            for result in list(results) + list(skipped or [])
+            if result['name']
+        )
@@ -46,6 +46,11 @@ urlpatterns = [
         r'^api/',
         include(router.urls)
     ),
+    url(
+        r'^events/(?P<task>[0-9a-f\-]{36})$',
+        views.ProgressView.as_view(),
+        name='events'
+    ),
     url(
         r'^webhook/(?P<username>\w[\w_\-]+)/(?P<repository>[\w\-.]+)$',
         views.WebHookView.as_view(),
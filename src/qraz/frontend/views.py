@@ -3,13 +3,27 @@
 
 import hashlib
 import hmac
+import json
+import mimetypes
 import os
+import re
+import uuid
 
 from django.conf import settings
 from django.contrib.auth import logout
+from django.db import transaction
 from django.http import (
+    Http404,
+    HttpResponse,
     HttpResponseBadRequest,
     HttpResponseNotFound,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.utils.cache import (
+    patch_cache_control,
+    patch_vary_headers,
 )
 from django.views.generic import (
     View,
@@ -23,7 +37,12 @@ from braces.views import (
     CsrfExemptMixin,
     JsonRequestResponseMixin
 )
-from django_downloadview import PathDownloadView
+from django_downloadview import (
+    DownloadResponse,
+    PathDownloadView,
+)
+from rest_framework import status
+from rest_framework.decorators import list_route
 from rest_framework.response import Response
 from rest_framework.viewsets import (
     ViewSet,
@@ -32,15 +51,28 @@ from rest_framework.viewsets import (
 )
 
 from . import (
+    builds,
+    journal,
     models,
+    progress,
+    routes,
     serializers,
     tasks,
 )
 from .mixins import (
     get_viewset_transition_action_mixin,
     CacheMixin,
+    ConditionalMixin,
     NeverCacheMixin
 )
+from .filters import (
+    QueryParameterFilter,
+    to_bool,
+)
+from .pagination import (
+    PresentationPagination,
+    RepositoryPagination,
+)
 
 
 class LogoutView(RedirectView):
@@ -72,27 +104,101 @@ class HelpView(TemplateView):
     template_name = 'qraz/help.html'
 
 
+class EventStream(object):
+    """
+    Iterate over the events of a stream and release its slot when the
+    response is closed, even if it was never iterated.
+    """
+
+    def __init__(self, iterator):
+        self.iterator = iterator
+
+    def __iter__(self):
+        return self.iterator
+
+    def close(self):
+        try:
+            self.iterator.close()
+        finally:
+            progress.streams.release()
+
+
+class ProgressView(LoginRequiredMixin, NeverCacheMixin, View):
+    """
+    Stream the progress events of a task as Server-Sent Events.
+
+    The stream ends once the task is ready or after
+    `TASK_PROGRESS_STREAM_TIMEOUT` seconds, in which case the browser
+    reconnects and starts with the latest event. Once
+    `TASK_PROGRESS_MAX_STREAMS` streams are open in this process, further
+    clients only get the latest event and reconnect after
+    `TASK_PROGRESS_RETRY` milliseconds. Clients not accepting
+    `text/event-stream` get the latest event as JSON, for polling.
+    """
+
+    def format(self, event):
+        return 'event: progress\ndata: {}\n\n'.format(json.dumps(event))
+
+    def stream(self, task):
+        for event in progress.subscribe(task):
+            if event is None:
+                yield ': keepalive\n\n'
+                continue
+            yield self.format(event)
+
+    def get(self, request, task):
+        if progress.get_owner(task) != request.user.pk:
+            raise Http404
+        if 'text/event-stream' not in request.META.get('HTTP_ACCEPT', ''):
+            return JsonResponse(progress.get_latest(task))
+        if not progress.streams.acquire(blocking=False):
+            return HttpResponse(
+                'retry: {}\n{}'.format(settings.TASK_PROGRESS_RETRY, self.format(progress.get_latest(task))),
+                content_type='text/event-stream'
+            )
+        response = StreamingHttpResponse(EventStream(self.stream(task)), content_type='text/event-stream')
+        # Keep reverse proxies from buffering the stream.
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
 class WebHookView(CsrfExemptMixin, JsonRequestResponseMixin, View):
     require_json = True
+    # Github lists at most this many commits in a push payload.
+    max_push_commits = 20
+    # Supported signature headers, strongest first.
+    signatures = (
+        ('HTTP_X_HUB_SIGNATURE_256', 'sha256', hashlib.sha256),
+        ('HTTP_X_HUB_SIGNATURE', 'sha1', hashlib.sha1),
+    )
+
+    def verify(self, secret):
+        """
+        Check the request body against the strongest signature sent.
+        """
+        for header, name, digestmod in self.signatures:
+            if header not in self.request.META:
+                continue
+            sha_name, _, signature = self.request.META[header].partition('=')
+            if sha_name != name:
+                return False
+            mac = hmac.new(
+                secret.encode('utf-8'),
+                msg=self.request.body,
+                digestmod=digestmod
+            )
+            return hmac.compare_digest(mac.hexdigest(), signature)
+        return False
 
     def post(self, request, username, repository):
-        if 'HTTP_X_HUB_SIGNATURE' not in request.META:
-            return HttpResponseBadRequest('No X-GITHUB-EVENT header found')
+        if not any(header in request.META for header, _, _ in self.signatures):
+            return HttpResponseBadRequest('No X-HUB-SIGNATURE header found')
         if 'HTTP_X_GITHUB_EVENT' not in request.META:
             return HttpResponseBadRequest('No X-GITHUB-EVENT header found')
-        try:
-            repo = models.Repository.objects.get(name=repository, user__username=username)
-        except models.Repository.DoesNotExist:
+        repo = routes.hooks.lookup(username, repository)
+        if repo is None:
             return HttpResponseNotFound()
-        sha_name, signature = request.META['HTTP_X_HUB_SIGNATURE'].split('=')
-        if sha_name != 'sha1':
-            return HttpResponseBadRequest('Invalid X-HUB-SIGNATURE digest mode found')
-        mac = hmac.new(
-            repo.secret.encode('utf-8'),
-            msg=request.body,
-            digestmod=hashlib.sha1
-        )
-        if not hmac.compare_digest(mac.hexdigest(), signature):
+        if not self.verify(repo['secret']):
             return HttpResponseBadRequest('Invalid X-HUB-SIGNATURE header found')
         event = 'on_{}'.format(request.META['HTTP_X_GITHUB_EVENT'])
         if not hasattr(self, event):
@@ -102,63 +208,312 @@ class WebHookView(CsrfExemptMixin, JsonRequestResponseMixin, View):
         return self.render_json_response(response)
 
     def on_ping(self, repository):
-        repository.hook = self.request_json['hook_id']
-        repository.save()
+        models.Repository.objects.filter(pk=repository['pk']).update(
+            hook=self.request_json['hook_id']
+        )
         return {}
 
+    def is_relevant_push(self, repository, payload, default_ref):
+        """
+        Decide from the push payload whether the push may change any built
+        presentation.
+        """
+        if 'default_branch' in payload.get('repository', {}) and payload.get('ref') != default_ref:
+            return False
+        commits = payload.get('commits') or []
+        # Forced pushes and truncated or empty commit lists do not tell the
+        # full set of changed files.
+        if payload.get('forced') or not commits or len(commits) >= self.max_push_commits:
+            return True
+        paths = set()
+        for commit in commits:
+            for key in ('added', 'modified', 'removed'):
+                paths.update(commit.get(key, []))
+        return models.touches(repository['inputs'], paths)
+
     def on_push(self, repository):
-        task = tasks.BuildTask().delay(repository)
+        """
+        Journal relevant pushes, which keeps accepting them while the broker
+        is unavailable.
+
+        The journal is dispatched by a thread of this process once the
+        request is committed, or else by the `dispatch_events` command.
+        """
+        payload = self.request_json
+        default_ref = 'refs/heads/{}'.format(payload.get('repository', {}).get('default_branch'))
+        delivery = self.request.META.get('HTTP_X_GITHUB_DELIVERY') or str(uuid.uuid4())
+        queued = False
+        if self.is_relevant_push(repository, payload, default_ref):
+            head = payload.get('after') if payload.get('ref') == default_ref else None
+            queued = journal.record(delivery, repository['pk'], head)
+            if queued:
+                transaction.on_commit(journal.notify)
         return {
-            'uuid': repository.id,
-            'state': repository.state,
-            'task': task.id,
+            'uuid': repository['pk'],
+            'state': repository['state'],
+            'delivery': delivery,
+            'queued': queued,
         }
 
 
 class DownloadView(CacheMixin, PathDownloadView):
+    """
+    Serve the published files of a presentation.
+
+    Precompressed variants are negotiated through `Accept-Encoding` and
+    strong ETags are taken from the ETag manifest of the published version.
+    If `HOVERCRAFT_SENDFILE` is enabled the file is handed off to the web
+    server by `SmartDownloadMiddleware`, otherwise single range requests are
+    answered here.
+    """
     attachment = False
+    range_re = re.compile(r'^bytes=(\d*)-(\d*)$')
+    range_blocksize = 65536
 
-    def get_path(self):
-        """Return path inside fixtures directory."""
-        presentation = models.Presentation.objects.get(
-            name=self.kwargs['presentation'],
-            repository__name=self.kwargs['repository'],
-            repository__user__username=self.kwargs['username'],
-            repository__site=self.request.site
+    def get_version(self, pk):
+        """
+        Resolve the published symlink once, so a request never mixes files
+        of two versions.
+        """
+        target = builds.get_target(pk)
+        try:
+            return os.path.join(settings.HOVERCRAFT_ROOT, os.readlink(target))
+        except OSError:
+            # Missing or published before versioning.
+            return target
+
+    def get_accepted_encodings(self):
+        accepted = set()
+        for item in self.request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+            name, _, params = item.partition(';')
+            if re.match(r'^\s*q\s*=\s*0(\.0*)?\s*$', params):
+                continue
+            accepted.add(name.strip().lower())
+        return accepted
+
+    def resolve(self):
+        pk = routes.index.lookup(
+            self.request.site.pk,
+            self.kwargs['username'],
+            self.kwargs['repository'],
+            self.kwargs['presentation']
         )
+        if pk is None:
+            raise Http404()
         # Get path from URL resolvers or as_view kwarg.
         relative_path = super(DownloadView, self).get_path()
-        # Make it absolute.
         if not relative_path:
             relative_path = 'index.html'
-        absolute_path = os.path.join(
-            settings.HOVERCRAFT_ROOT,
-            str(presentation.pk),
-            relative_path
-        )
-        return absolute_path
+        if any(part.startswith('.') for part in relative_path.split('/')):
+            raise Http404()
+        version = self.get_version(pk)
+        self.original_path = os.path.join(version, relative_path)
+        self.file_path = self.original_path
+        self.content_encoding = None
+        self.etag = None
+        self.vary = False
+        entry = builds.load_etags(version).get(relative_path)
+        if not entry:
+            return
+        accepted = self.get_accepted_encodings()
+        for encoding in entry['encodings']:
+            if encoding in accepted:
+                self.content_encoding = encoding
+                self.file_path += builds.ENCODINGS[encoding]
+                break
+        if self.content_encoding:
+            self.etag = '"{}-{}"'.format(entry['etag'], self.content_encoding)
+        else:
+            self.etag = '"{}"'.format(entry['etag'])
+        self.vary = bool(entry['encodings'])
 
+    def get_path(self):
+        return self.file_path
+
+    def get_mimetype(self):
+        return mimetypes.guess_type(self.original_path)[0]
+
+    def set_headers(self, response):
+        # Clients and the site wide cache revalidate on every use, which is
+        # cheap thanks to ETags and never serves a superseded build.
+        patch_cache_control(response, max_age=0, must_revalidate=True)
+        if self.etag:
+            response['ETag'] = self.etag
+        if self.content_encoding:
+            response['Content-Encoding'] = self.content_encoding
+        if self.vary:
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    def is_not_modified(self):
+        header = self.request.META.get('HTTP_IF_NONE_MATCH')
+        if not header or not self.etag:
+            return False
+        etags = [etag.strip() for etag in header.split(',')]
+        return '*' in etags or self.etag in etags
 
-class RepositoryViewSet(get_viewset_transition_action_mixin(models.Repository), ReadOnlyModelViewSet):
+    def get_range(self, size):
+        """
+        Parse a single byte range request, returning `None` to serve the
+        whole file or `False` if the range is not satisfiable.
+        """
+        header = self.request.META.get('HTTP_RANGE')
+        if_range = self.request.META.get('HTTP_IF_RANGE')
+        if not header or (if_range and if_range != self.etag):
+            return None
+        match = self.range_re.match(header.strip())
+        if not match or match.groups() == ('', ''):
+            return None
+        start, end = match.groups()
+        if not start:
+            if not int(end) or not size:
+                return False
+            return max(size - int(end), 0), size - 1
+        start = int(start)
+        if end and int(end) < start:
+            # Invalid ranges are ignored, see RFC 7233, section 3.1.
+            return None
+        if start >= size:
+            return False
+        return start, min(int(end), size - 1) if end else size - 1
+
+    def read_range(self, stream, start, length):
+        try:
+            stream.seek(start)
+            while length > 0:
+                block = stream.read(min(self.range_blocksize, length))
+                if not block:
+                    break
+                length -= len(block)
+                yield block
+        finally:
+            stream.close()
+
+    def get_range_response(self, response):
+        size = self.file_instance.size
+        byte_range = self.get_range(size)
+        if byte_range is None:
+            response['Accept-Ranges'] = 'bytes'
+            return response
+        response.close()
+        if byte_range is False:
+            partial = HttpResponse(status=416)
+            partial['Content-Range'] = 'bytes */{}'.format(size)
+            return partial
+        start, end = byte_range
+        partial = StreamingHttpResponse(
+            self.read_range(open(self.file_path, 'rb'), start, end - start + 1),
+            status=206,
+            content_type=response['Content-Type']
+        )
+        partial['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+        partial['Content-Length'] = end - start + 1
+        partial['Accept-Ranges'] = 'bytes'
+        return self.set_headers(partial)
+
+    def get_cache_key(self):
+        # Only versioned builds carry ETags, their file paths change with
+        # every build. Handed off and partial responses are not cached.
+        if not self.etag or settings.HOVERCRAFT_SENDFILE or 'HTTP_RANGE' in self.request.META:
+            return None
+        digest = hashlib.sha1(self.file_path.encode('utf-8')).hexdigest()
+        return 'qraz:response:{}'.format(digest)
+
+    def load_response(self, response):
+        """
+        Read small files into a regular response so they can be cached.
+        """
+        if self.get_cache_key() is None or self.file_instance.size > self.cache_max_size:
+            return response
+        loaded = HttpResponse(self.file_instance.read(), content_type=response['Content-Type'])
+        loaded['Accept-Ranges'] = 'bytes'
+        response.close()
+        return self.cache_response(self.set_headers(loaded))
+
+    def get(self, request, *args, **kwargs):
+        self.resolve()
+        if self.is_not_modified():
+            return self.set_headers(HttpResponseNotModified())
+        response = self.get_cached_response()
+        if response is not None:
+            return response
+        response = self.render_to_response()
+        if not isinstance(response, DownloadResponse):
+            return response
+        self.set_headers(response)
+        if settings.HOVERCRAFT_SENDFILE:
+            return response
+        return self.load_response(self.get_range_response(response))
+
+
+class RepositoryViewSet(ConditionalMixin, get_viewset_transition_action_mixin(models.Repository), ReadOnlyModelViewSet):
     """
     API endpoint that allows repositories to be viewed.
     """
     serializer_class = serializers.RepositorySerializer
+    pagination_class = RepositoryPagination
+    filter_backends = (QueryParameterFilter,)
+    filter_lookups = {
+        'state': ('state', str),
+        'fork': ('fork', to_bool),
+        'name': ('name__startswith', str),
+    }
     permission_classes = []
+    # Activation and deactivation talk to Github, keep them off the request.
+    transition_task = tasks.TransitionTask
 
     def get_queryset(self):
         """
         This view should return a list of all the repositories
         for the currently authenticated user.
         """
-        return models.Repository.objects.filter(site=self.request.site, user=self.request.user)
+        queryset = models.Repository.objects.filter(site=self.request.site, user=self.request.user)
+        if self.action == 'list':
+            # The serializer only needs these, skip the rendered comments.
+            queryset = queryset.only('id', 'name', 'state')
+        return queryset
+
+    @list_route(methods=['post'])
+    def bulk(self, request):
+        """
+        Move all repositories listed in `ids` to `state` in a background
+        task reporting the result for each repository.
+        """
+        serializer = serializers.BulkTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        task_id = str(uuid.uuid4())
+        progress.register(task_id, request.user.pk)
+        task = tasks.BulkTransitionTask().apply_async(
+            (
+                request.user.pk,
+                request.site.pk,
+                serializer.validated_data['ids'],
+                serializer.validated_data['state']
+            ),
+            task_id=task_id
+        )
+        return Response(
+            {
+                'id': task.id,
+                'state': task.state,
+                'result': None,
+            },
+            status=status.HTTP_202_ACCEPTED
+        )
 
 
-class PresentationViewSet(ReadOnlyModelViewSet):
+class PresentationViewSet(ConditionalMixin, ReadOnlyModelViewSet):
     """
     API endpoint that allows presentations to be viewed.
     """
+    conditional_fields = ('modified', 'repository__modified')
     serializer_class = serializers.PresentationSerializer
+    pagination_class = PresentationPagination
+    filter_backends = (QueryParameterFilter,)
+    filter_lookups = {
+        'repository': ('repository', int),
+        'name': ('name__startswith', str),
+    }
     permission_classes = []
 
     def get_queryset(self):
@@ -166,14 +521,34 @@ class PresentationViewSet(ReadOnlyModelViewSet):
         This view should return a list of all the presentations
         for the currently authenticated user.
         """
-        return models.Presentation.objects.filter(repository__site=self.request.site, repository__user=self.request.user)
+        return models.Presentation.objects.filter(
+            repository__site=self.request.site,
+            repository__user=self.request.user
+        ).select_related(
+            'repository__user',
+            'repository__site'
+        ).only(
+            'id',
+            'name',
+            'repository',
+            'repository__name',
+            'repository__user',
+            'repository__user__username',
+            'repository__site',
+            'repository__site__domain'
+        )
 
 
 class SynchronizationViewSet(NeverCacheMixin, ViewSet):
     permission_classes = []
 
     def create(self, request):
-        task = tasks.SynchronizationTask().delay(request.user, request.site)
+        task_id = str(uuid.uuid4())
+        progress.register(task_id, request.user.pk)
+        task = tasks.SynchronizationTask().apply_async(
+            (request.user.pk, request.site.pk),
+            task_id=task_id
+        )
         return Response({
             'id': task.id,
             'state': task.state,
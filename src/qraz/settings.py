@@ -12,6 +12,10 @@ import os
 
 from docutils.core import publish_parts
 from IPy import IP
+from kombu import (
+    Exchange,
+    Queue,
+)
 
 from django.core.urlresolvers import reverse_lazy as reverse
 
@@ -95,7 +99,6 @@ INSTALLED_APPS = (
 MIDDLEWARE_CLASSES = (
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
-    'django.middleware.cache.UpdateCacheMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -103,7 +106,6 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.contrib.sites.middleware.CurrentSiteMiddleware',
-    'django.middleware.cache.FetchFromCacheMiddleware',
     'django_downloadview.SmartDownloadMiddleware',
 )
 
@@ -143,8 +145,9 @@ CACHES = {
         'KEY_PREFIX': __package__,
     }
 }
-CACHE_MIDDLEWARE_SECONDS = 60
-CACHE_MIDDLEWARE_KEY_PREFIX = SITE_ID
+
+ROUTE_INDEX_SIZE = 10000
+ROUTE_INDEX_TTL = 5
 
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'UTC'
@@ -199,6 +202,35 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 HOVERCRAFT_ROOT = os.path.join(BASE_DIR, 'hovercraft')
+HOVERCRAFT_BINARY = '/usr/bin/hovercraft'
+HOVERCRAFT_CONCURRENCY = int(os.environ.get('DJANGO_HOVERCRAFT_CONCURRENCY', os.cpu_count() or 1))
+HOVERCRAFT_TIMEOUT = int(os.environ.get('DJANGO_HOVERCRAFT_TIMEOUT', 300))
+HOVERCRAFT_GRACE_PERIOD = int(os.environ.get('DJANGO_HOVERCRAFT_GRACE_PERIOD', 600))
+HOVERCRAFT_COMPRESS_MIN_SIZE = 256
+BUILD_COALESCE_TIMEOUT = 3600
+EVENT_DISPATCH_BATCH_SIZE = 100
+EVENT_DISPATCH_INTERVAL = 1.0
+# Broker connect timeout of the dispatcher thread in web server processes.
+EVENT_DISPATCH_CONNECT_TIMEOUT = 2
+# Events claimed longer ago by a dispatcher that died are dispatched again.
+EVENT_DISPATCH_CLAIM_TIMEOUT = 60
+EVENT_RETENTION = 7 * 24 * 60 * 60
+# Pending transition locks must outlive the hard time limit of
+# BulkTransitionTask, which holds them while it runs.
+TRANSITION_TIMEOUT = 15 * 60
+
+GIT_MIRROR_ROOT = os.path.join(BASE_DIR, 'mirrors')
+GIT_MIRROR_CACHE_SIZE = int(os.environ.get('DJANGO_GIT_MIRROR_CACHE_SIZE', 10 * 1024 ** 3))
+
+GITHUB_API_URL = os.environ.get('DJANGO_GITHUB_API_URL', 'https://api.github.com')
+GITHUB_TIMEOUT = 10
+GITHUB_CACHE_TIMEOUT = 7 * 24 * 3600
+GITHUB_POOL_SIZE = 10
+GITHUB_BURST = 20
+GITHUB_MAX_WAIT = 10
+GITHUB_RATE_LIMIT_RESERVE = 100
+# Repositories whose hooks are managed in parallel by bulk transitions.
+GITHUB_HOOK_CONCURRENCY = 8
 
 CRISPY_TEMPLATE_PACK = 'bootstrap3'
 
@@ -240,13 +272,14 @@ REST_FRAMEWORK = {
     ]
 }
 
-DOWNLOADVIEW_BACKEND = 'django_downloadview.apache.XSendfileMiddleware'
-DOWNLOADVIEW_RULES = [
-    {
-        'source_url': '/media/apache/',
-        'destination_dir': '/apache-optimized-by-middleware/'
-    }
-]
+HOVERCRAFT_SENDFILE = not DEBUG
+DOWNLOADVIEW_BACKEND = 'qraz.frontend.middlewares.XSendfileMiddleware'
+DOWNLOADVIEW_RULES = []
+if HOVERCRAFT_SENDFILE:
+    DOWNLOADVIEW_RULES.append({
+        'source_dir': HOVERCRAFT_ROOT,
+        'destination_dir': HOVERCRAFT_ROOT,
+    })
 
 CORS_ORIGIN_ALLOW_ALL = True
 
@@ -261,8 +294,85 @@ BROKER_URL = 'amqp://{username}:{password}@{hostname}/{vhost}'.format(
     vhost=os.environ.get('CELERY_BROKER_VHOST')
 )
 CELERY_RESULT_BACKEND = os.environ.get('DJANGO_CELERY_RESULT_BACKEND', 'rpc://')
-CELERY_TASK_SERIALIZER = 'pickle'
-CELERY_ACCEPT_CONTENT = ['pickle']
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_SERIALIZER = 'json'
+TASK_PROGRESS_INTERVAL = 1.0
+TASK_PROGRESS_TIMEOUT = 60 * 60
+TASK_PROGRESS_HEARTBEAT = 15
+TASK_PROGRESS_STREAM_TIMEOUT = 5 * 60
+# Concurrent event streams per web server process, further clients poll.
+TASK_PROGRESS_MAX_STREAMS = 4
+TASK_PROGRESS_RETRY = 2000
+# Fanning builds out over the workers needs a result backend with chord support.
+HOVERCRAFT_FANOUT = not CELERY_RESULT_BACKEND.startswith('rpc://')
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_QUEUES = tuple(
+    Queue(name, Exchange(name), routing_key=name, queue_arguments={'x-max-priority': 10})
+    for name in ('build', 'sync', 'hooks')
+)
+CELERY_DEFAULT_QUEUE = 'sync'
+CELERY_DEFAULT_EXCHANGE = 'sync'
+CELERY_DEFAULT_ROUTING_KEY = 'sync'
+# Within the build queue, finishing started builds takes precedence over
+# starting new ones.
+CELERY_ROUTES = {
+    'qraz.frontend.tasks.BuildTask': {'queue': 'build', 'priority': 3},
+    'qraz.frontend.tasks.PresentationBuildTask': {'queue': 'build', 'priority': 5},
+    'qraz.frontend.tasks.BuildCleanupTask': {'queue': 'build', 'priority': 9},
+    'qraz.frontend.tasks.SynchronizationTask': {'queue': 'sync', 'priority': 5},
+    'qraz.frontend.tasks.TransitionTask': {'queue': 'hooks', 'priority': 5},
+    'qraz.frontend.tasks.BulkTransitionTask': {'queue': 'hooks', 'priority': 5},
+}
+# Builds are idempotent, so they are acknowledged late and redelivered if a
+# worker dies.
+CELERY_ANNOTATIONS = {
+    'qraz.frontend.tasks.BuildTask': {
+        'acks_late': True,
+        'soft_time_limit': 30 * 60,
+        'time_limit': 32 * 60,
+    },
+    'qraz.frontend.tasks.PresentationBuildTask': {
+        'acks_late': True,
+        'soft_time_limit': HOVERCRAFT_TIMEOUT + 120,
+        'time_limit': HOVERCRAFT_TIMEOUT + 180,
+    },
+    'qraz.frontend.tasks.BuildCleanupTask': {
+        'soft_time_limit': 60,
+        'time_limit': 90,
+    },
+    'qraz.frontend.tasks.SynchronizationTask': {
+        'soft_time_limit': 10 * 60,
+        'time_limit': 11 * 60,
+    },
+    'qraz.frontend.tasks.TransitionTask': {
+        'soft_time_limit': 60,
+        'time_limit': 90,
+    },
+    # Keep the hard limit below TRANSITION_TIMEOUT.
+    'qraz.frontend.tasks.BulkTransitionTask': {
+        'soft_time_limit': 10 * 60,
+        'time_limit': 11 * 60,
+    },
+}
+CELERYD_PREFETCH_MULTIPLIER = 1
+# Start a worker with CELERY_WORKER_PROFILE set to one of these to have it
+# consume only the listed queues with the given settings.
+CELERY_WORKER_PROFILES = {
+    'build': {
+        'queues': ['build'],
+        'settings': {
+            'CELERYD_CONCURRENCY': int(os.environ.get('CELERY_BUILD_CONCURRENCY', 2)),
+            'CELERYD_PREFETCH_MULTIPLIER': 1,
+        },
+    },
+    'interactive': {
+        'queues': ['sync', 'hooks'],
+        'settings': {
+            'CELERYD_CONCURRENCY': int(os.environ.get('CELERY_INTERACTIVE_CONCURRENCY', 8)),
+            'CELERYD_PREFETCH_MULTIPLIER': 4,
+        },
+    },
+}
 
 LOGGING = {
     'version': 1,
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.db import connection
+from django.test import (
+    TestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+
+from qraz.frontend import models
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+        }
+    }
+)
+class QueryCountTest(TestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(domain='testserver', name='testserver')
+        self.user = get_user_model().objects.create_user('alice')
+        self.client.force_login(self.user)
+
+    def create_presentations(self, start, count):
+        for github in range(start, start + count):
+            repository = models.Repository.objects.create(
+                site=self.site,
+                user=self.user,
+                github=github,
+                name='repository-{}'.format(github)
+            )
+            models.Presentation.objects.create(
+                repository=repository,
+                name='presentation',
+                path='presentation.rst'
+            )
+
+    def count_queries(self, url):
+        with self.settings(SITE_ID=self.site.pk):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context), len(response.data['results'])
+
+    def assertConstantQueries(self, url):
+        self.create_presentations(0, 1)
+        queries, count = self.count_queries(url)
+        self.assertEqual(count, 1)
+        self.create_presentations(1, 20)
+        self.assertEqual(self.count_queries(url), (queries, 21))
+
+    def test_presentations(self):
+        self.assertConstantQueries('/api/presentations/')
+
+    def test_repositories(self):
+        self.assertConstantQueries('/api/repositories/')
+
+    def test_filters(self):
+        self.create_presentations(0, 3)
+        with self.settings(SITE_ID=self.site.pk):
+            response = self.client.get('/api/repositories/?name=repository-1&fields=name')
+            self.assertEqual(response.data['results'], [{'name': 'repository-1'}])
+            response = self.client.get('/api/repositories/?state=active')
+            self.assertEqual(response.data['results'], [])
+            response = self.client.get('/api/repositories/?fork=maybe')
+            self.assertEqual(response.status_code, 400)
+
+    def test_conditional_get(self):
+        self.create_presentations(0, 2)
+        with self.settings(SITE_ID=self.site.pk):
+            response = self.client.get('/api/presentations/')
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            response = self.client.get('/api/presentations/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.create_presentations(2, 1)
+            response = self.client.get('/api/presentations/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+    def test_conditional_detail(self):
+        self.create_presentations(0, 1)
+        repository = models.Repository.objects.get()
+        with self.settings(SITE_ID=self.site.pk):
+            url = '/api/repositories/{}/'.format(repository.pk)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+            self.assertEqual(response.status_code, 304)
+            url = '/api/repositories/{}/'.format(repository.pk + 1)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+            self.assertEqual(response.status_code, 404)
+            response = self.client.get('/api/repositories/abc/')
+            self.assertEqual(response.status_code, 404)
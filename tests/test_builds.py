@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import (
+    SimpleTestCase,
+    override_settings,
+)
+
+from qraz.frontend import builds
+
+SOURCE = '''\
+:css: css/campus02.css
+:js-body: js/slides.js
+
+.. include:: parts/intro.rst
+
+----
+
+.. image:: images/logo.png
+.. figure:: https://example.com/remote.png
+.. image:: ../outside.png
+.. image:: images/missing.png
+'''
+
+
+class ResourcesTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        self.copy = os.path.join(self.root, 'copy')
+        self.write('04-html.rst', SOURCE)
+        self.write('css/campus02.css', 'body { background: url("../fonts/campus.woff?v=2"); }')
+        self.write('fonts/campus.woff', 'font')
+        self.write('js/slides.js', '')
+        self.write('parts/intro.rst', '.. figure:: images/chart.svg\n')
+        self.write('images/logo.png', 'logo')
+        self.write('images/chart.svg', 'chart')
+        self.write('README.md', 'readme')
+        self.write('src/app/main.py', 'print()')
+        self.write(os.path.join('..', 'outside.png'), 'outside')
+        self.source = os.path.join(self.copy, '04-html.rst')
+
+    def write(self, path, data):
+        path = os.path.join(self.copy, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as stream:
+            stream.write(data)
+
+    def test_root_source(self):
+        self.assertEqual(
+            builds.get_resources(self.copy, self.source),
+            [
+                'css/campus02.css',
+                'fonts/campus.woff',
+                'images/chart.svg',
+                'images/logo.png',
+                'js/slides.js',
+                'parts/intro.rst',
+            ]
+        )
+
+    def test_manifest(self):
+        resources = builds.get_resources(self.copy, self.source)
+        index = {'images/logo.png': 'a' * 40}
+        manifest = builds.get_manifest(self.copy, self.source, {}, '1.0', index, resources)
+        self.assertEqual(sorted(manifest['resources']), resources)
+        self.assertEqual(manifest['resources']['images/logo.png'], 'a' * 40)
+        self.write('README.md', 'changed')
+        self.write('src/app/main.py', 'changed')
+        self.assertEqual(builds.get_manifest(self.copy, self.source, {}, '1.0', index, resources), manifest)
+        self.write('fonts/campus.woff', 'changed')
+        self.assertNotEqual(builds.get_manifest(self.copy, self.source, {}, '1.0', index, resources), manifest)
+
+
+class BuildTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        self.copy = os.path.join(self.root, 'copy')
+        os.makedirs(os.path.join(self.copy, 'videos'))
+        with open(os.path.join(self.copy, 'videos', 'intro.webm'), 'wb') as stream:
+            stream.write(b'video')
+        override = override_settings(HOVERCRAFT_ROOT=os.path.join(self.root, 'hovercraft'))
+        override.enable()
+        self.addCleanup(override.disable)
+        self.presentation = SimpleNamespace(pk=1, name='slides', path='slides.rst')
+
+    def hovercraft(self, args, **kwargs):
+        with open(os.path.join(args[2], 'index.html'), 'w') as stream:
+            stream.write('<html></html>')
+
+    def test_assets_not_read(self):
+        index = {'videos/intro.webm': 'c' * 40}
+        with mock.patch.object(builds.subprocess, 'run', side_effect=self.hovercraft):
+            with mock.patch.object(builds, 'hash_file', wraps=builds.hash_file) as hash_file:
+                result = builds.build(self.copy, self.presentation, ['videos'], index)
+        self.assertTrue(result['success'])
+        # Only the generated file is hashed, assets are known by blob ID.
+        self.assertEqual(
+            [os.path.basename(args[0]) for args, kwargs in hash_file.call_args_list],
+            ['index.html']
+        )
+        self.assertTrue(os.path.exists(builds.get_blob('c' * 40)))
+        etags = builds.load_etags(os.path.realpath(builds.get_target(1)))
+        self.assertEqual(etags['videos/intro.webm']['etag'], 'c' * 40)
+        self.assertEqual(
+            etags['index.html']['etag'],
+            builds.hash_file(os.path.join(builds.get_target(1), 'index.html'))
+        )
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+from http.server import (
+    BaseHTTPRequestHandler,
+    HTTPServer,
+)
+
+from django.core.cache import cache
+from django.test import (
+    SimpleTestCase,
+    override_settings,
+)
+
+from qraz.frontend.clients import (
+    GithubClient,
+    RateLimited,
+)
+
+
+class GithubStub(BaseHTTPRequestHandler):
+    """
+    Answer API requests like Github, with the rate limit remaining taken
+    from the server.
+    """
+    etag = '"e7a5"'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, data=None, headers=None):
+        self.server.requests.append(self.path)
+        body = json.dumps(data).encode('utf-8') if data is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-RateLimit-Remaining', str(self.server.remaining))
+        self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/limited':
+            self.server.remaining = 0
+            self.reply(403, {'message': 'API rate limit exceeded'})
+        elif self.headers.get('If-None-Match') == self.etag:
+            self.reply(304)
+        else:
+            self.reply(200, {'login': 'alice'}, {'ETag': self.etag})
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+)
+class GithubClientTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.server = HTTPServer(('127.0.0.1', 0), GithubStub)
+        self.server.requests = []
+        self.server.remaining = 5000
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.github = GithubClient('token', 'http://127.0.0.1:{}'.format(self.server.server_port))
+
+    def test_conditional(self):
+        self.assertEqual(self.github.get_user(), {'login': 'alice'})
+        self.assertEqual(GithubClient.get_stats(), {'hits': 0, 'misses': 1})
+        self.assertEqual(self.github.get_user(), {'login': 'alice'})
+        self.assertEqual(GithubClient.get_stats(), {'hits': 1, 'misses': 1})
+        self.assertEqual(self.server.requests, ['/user', '/user'])
+
+    def test_conditional_per_token(self):
+        self.github.get_user()
+        other = GithubClient('other', self.github.base_url)
+        self.assertEqual(other.get_user(), {'login': 'alice'})
+        self.assertEqual(GithubClient.get_stats(), {'hits': 0, 'misses': 2})
+
+    def test_rate_limited(self):
+        with self.assertRaises(RateLimited) as context:
+            self.github.get('limited')
+        self.assertGreater(context.exception.retry_after, 3500)
+
+    def test_reserve(self):
+        self.server.remaining = 100
+        self.github.get('repos/alice/one')
+        self.github.get('repos/alice/two')
+        # Requests beyond the reserve are not sent at all.
+        with self.assertRaises(RateLimited):
+            self.github.get('repos/alice/three')
+        self.assertEqual(self.server.requests, ['/repos/alice/one', '/repos/alice/two'])
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+)
+
+from qraz.frontend.views import DownloadView
+
+
+class RangeTest(SimpleTestCase):
+    etag = '"e7a5"'
+
+    def get_range(self, header, size=100, **extra):
+        view = DownloadView()
+        view.request = RequestFactory().get('/', HTTP_RANGE=header, **extra)
+        view.etag = self.etag
+        return view.get_range(size)
+
+    def test_whole_file(self):
+        self.assertIsNone(self.get_range(''))
+        self.assertIsNone(self.get_range('bytes=-'))
+        self.assertIsNone(self.get_range('bytes=0-1,5-6'))
+        self.assertIsNone(self.get_range('items=0-1'))
+        # Invalid ranges are ignored.
+        self.assertIsNone(self.get_range('bytes=9-0'))
+
+    def test_range(self):
+        self.assertEqual(self.get_range('bytes=0-9'), (0, 9))
+        self.assertEqual(self.get_range(' bytes=10-10 '), (10, 10))
+        self.assertEqual(self.get_range('bytes=50-500'), (50, 99))
+
+    def test_open_range(self):
+        self.assertEqual(self.get_range('bytes=90-'), (90, 99))
+
+    def test_suffix(self):
+        self.assertEqual(self.get_range('bytes=-10'), (90, 99))
+        self.assertEqual(self.get_range('bytes=-200'), (0, 99))
+
+    def test_unsatisfiable(self):
+        self.assertIs(self.get_range('bytes=100-'), False)
+        self.assertIs(self.get_range('bytes=100-200'), False)
+        self.assertIs(self.get_range('bytes=-0'), False)
+        self.assertIs(self.get_range('bytes=-10', size=0), False)
+
+    def test_if_range(self):
+        self.assertEqual(self.get_range('bytes=0-9', HTTP_IF_RANGE=self.etag), (0, 9))
+        self.assertIsNone(self.get_range('bytes=0-9', HTTP_IF_RANGE='"0000"'))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.test import TestCase
+from django.utils import timezone
+
+from qraz.frontend import (
+    journal,
+    models,
+)
+
+
+@mock.patch('qraz.frontend.tasks.BuildCoalescer.submit')
+class DispatchTest(TestCase):
+
+    def setUp(self):
+        site = Site.objects.create(domain='testserver', name='testserver')
+        user = get_user_model().objects.create_user('alice')
+        self.repository = models.Repository.objects.create(
+            site=site,
+            user=user,
+            github=1,
+            name='slides'
+        )
+
+    def record(self, *deliveries):
+        for delivery in deliveries:
+            journal.record(delivery, self.repository.pk, 'a' * 40)
+
+    def test_dispatch(self, submit):
+        submit.return_value = ('b' * 36, False)
+        self.record('1', '2')
+        self.assertEqual(journal.dispatch(), 2)
+        # Both pushes are covered by one build of the branch tip.
+        submit.assert_called_once_with()
+        self.assertEqual(
+            set(models.Event.objects.values_list('task', flat=True)),
+            set(['b' * 36])
+        )
+        self.assertFalse(models.Event.objects.filter(dispatched=None).exists())
+        self.assertEqual(journal.dispatch(), 0)
+
+    def test_broker_failure(self, submit):
+        submit.side_effect = IOError('broker down')
+        self.record('1')
+        self.assertEqual(journal.dispatch(), 0)
+        event = models.Event.objects.get()
+        self.assertIsNone(event.dispatched)
+        self.assertEqual(event.task, '')
+
+    def test_concurrent(self, submit):
+        # Another dispatcher runs while the events are being handed on.
+        def dispatch_again():
+            self.assertEqual(journal.dispatch(), 0)
+            return 'b' * 36, False
+
+        submit.side_effect = dispatch_again
+        self.record('1')
+        self.assertEqual(journal.dispatch(), 1)
+        self.assertEqual(submit.call_count, 1)
+
+    def test_stale_claim(self, submit):
+        submit.return_value = ('b' * 36, False)
+        self.record('1')
+        models.Event.objects.update(dispatched=timezone.now(), task='claim:1')
+        self.assertEqual(journal.dispatch(), 0)
+        models.Event.objects.update(dispatched=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(journal.dispatch(), 1)
+        self.assertEqual(models.Event.objects.get().task, 'b' * 36)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+
+import pygit2
+
+from django.test import SimpleTestCase
+
+from qraz.frontend.mirrors import MirrorCache
+
+
+class MirrorCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.source = pygit2.init_repository(os.path.join(self.root, 'source'), bare=True)
+        self.url = 'file://{}'.format(self.source.path.rstrip('/'))
+        self.cache = MirrorCache(os.path.join(self.root, 'mirrors'), 10 * 1024 ** 2)
+
+    def commit(self, files):
+        """
+        Commit `files` to the master branch of the source repository and
+        return the commit SHA.
+        """
+        builder = self.source.TreeBuilder()
+        for name, data in sorted(files.items()):
+            builder.insert(name, self.source.create_blob(data), pygit2.GIT_FILEMODE_BLOB)
+        signature = pygit2.Signature('alice', 'alice@example.com')
+        parents = [] if self.source.is_empty else [self.source.head.target]
+        return str(self.source.create_commit(
+            'refs/heads/master',
+            signature,
+            signature,
+            'Update slides',
+            builder.write(),
+            parents
+        ))
+
+    def checkout(self, key, revision, index=None):
+        directory = tempfile.mkdtemp(dir=self.root)
+        return self.cache.checkout(key, self.url, revision, directory, index), directory
+
+    def read(self, directory, name):
+        with open(os.path.join(directory, name), 'rb') as stream:
+            return stream.read()
+
+    def test_fetch(self):
+        first = self.commit({'slides.rst': b'first'})
+        index = {}
+        sha, directory = self.checkout(1, 'master', index)
+        self.assertEqual(sha, first)
+        self.assertEqual(self.read(directory, 'slides.rst'), b'first')
+        self.assertEqual(index, {'slides.rst': str(self.source[first].tree['slides.rst'].id)})
+        self.assertFalse(os.path.exists(os.path.join(directory, '.git')))
+        second = self.commit({'slides.rst': b'second'})
+        sha, directory = self.checkout(1, 'master')
+        self.assertEqual(sha, second)
+        self.assertEqual(self.read(directory, 'slides.rst'), b'second')
+
+    def test_checkout_by_sha(self):
+        first = self.commit({'slides.rst': b'first'})
+        self.checkout(1, 'master')
+        second = self.commit({'slides.rst': b'second'})
+        # A known commit is exported without fetching.
+        sha, directory = self.checkout(1, first)
+        self.assertEqual(sha, first)
+        self.assertEqual(self.read(directory, 'slides.rst'), b'first')
+        self.assertNotIn(second, pygit2.Repository(self.cache.get_path(1)))
+        # An unknown one is fetched first.
+        sha, directory = self.checkout(1, second)
+        self.assertEqual(sha, second)
+        self.assertEqual(self.read(directory, 'slides.rst'), b'second')
+
+    def test_eviction(self):
+        self.commit({'slides.rst': b'first'})
+        self.checkout(1, 'master')
+        self.checkout(2, 'master')
+        self.assertTrue(os.path.isdir(self.cache.get_path(1)))
+        self.cache.budget = 0
+        self.checkout(2, 'master')
+        # The mirror just used is kept even if the cache exceeds its budget.
+        self.assertFalse(os.path.isdir(self.cache.get_path(1)))
+        self.assertTrue(os.path.isdir(self.cache.get_path(2)))
+
+    def test_eviction_skips_locked(self):
+        self.commit({'slides.rst': b'first'})
+        self.checkout(1, 'master')
+        self.cache.budget = 0
+        with self.cache.lock(self.cache.get_path(1)):
+            self.checkout(2, 'master')
+        self.assertTrue(os.path.isdir(self.cache.get_path(1)))
+
+    def test_remove(self):
+        self.commit({'slides.rst': b'first'})
+        self.checkout(1, 'master')
+        self.cache.remove(1)
+        self.assertFalse(os.path.isdir(self.cache.get_path(1)))
+        self.cache.remove(1)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+from django.test import SimpleTestCase
+
+from qraz.frontend.models import touches
+
+
+class TouchesTest(SimpleTestCase):
+    inputs = json.dumps([
+        'css',
+        'slides/**',
+        'slides/talk.rst',
+    ])
+
+    def test_unknown_configuration(self):
+        self.assertTrue(touches('', ['README.rst']))
+
+    def test_configuration(self):
+        self.assertTrue(touches(self.inputs, ['.hovercraft.yml']))
+        self.assertTrue(touches(self.inputs, ['./.hovercraft.yml']))
+
+    def test_source(self):
+        self.assertTrue(touches(self.inputs, ['slides/talk.rst']))
+        self.assertTrue(touches(self.inputs, ['slides/../slides/talk.rst']))
+
+    def test_resources(self):
+        self.assertTrue(touches(self.inputs, ['slides/images/logo.png']))
+        self.assertTrue(touches(self.inputs, ['slides/notes.txt']))
+
+    def test_asset_directory(self):
+        self.assertTrue(touches(self.inputs, ['css/print/style.css']))
+
+    def test_root_source(self):
+        # Inputs recorded for the layout documented on the help page.
+        inputs = json.dumps([
+            '04-html.rst',
+            'css/campus02.css',
+            'figures',
+            'images/logo.png',
+            'videos',
+        ])
+        self.assertTrue(touches(inputs, ['04-html.rst']))
+        self.assertTrue(touches(inputs, ['css/campus02.css']))
+        self.assertTrue(touches(inputs, ['videos/intro.webm']))
+        self.assertFalse(touches(inputs, ['README.md', 'src/app/main.py', 'images/unused.png']))
+
+    def test_unrelated(self):
+        self.assertFalse(touches(self.inputs, []))
+        self.assertFalse(touches(self.inputs, ['README.rst', 'docs/slides/talk.rst', 'cssx/style.css']))
+        self.assertTrue(touches(self.inputs, ['README.rst', 'css/style.css']))
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+)
+
+from social.apps.django_app.default.models import UserSocialAuth
+
+from qraz.frontend import (
+    models,
+    tasks,
+)
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+)
+class BuildCoalescerTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.started = []
+        patcher = mock.patch.object(tasks.BuildTask, 'apply_async', side_effect=self.apply_async)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.coalescer = tasks.BuildCoalescer(1)
+
+    def apply_async(self, args, **options):
+        self.started.append(args[1])
+
+    def test_coalesce(self):
+        task_id, coalesced = self.coalescer.submit('H0')
+        self.assertFalse(coalesced)
+        self.assertEqual(self.coalescer.submit('H1'), (task_id, True))
+        self.assertEqual(self.coalescer.submit('H2'), (task_id, True))
+        # One follow-up build of the branch tip covers both pushes.
+        self.assertIsNotNone(self.coalescer.finish())
+        self.assertIsNone(self.coalescer.finish())
+        self.assertEqual(self.started, ['H0', None])
+
+    def test_push_while_finishing(self):
+        self.coalescer.submit('H0')
+        self.coalescer.submit('H1')
+        delete = cache.delete
+
+        def push(key):
+            # A push lands right after the lock was released.
+            delete(key)
+            if key == self.coalescer.get_key('lock') and len(self.started) == 1:
+                self.coalescer.submit('H2')
+
+        with mock.patch.object(tasks.cache, 'delete', side_effect=push):
+            self.assertIsNone(self.coalescer.finish())
+        self.assertIsNone(self.coalescer.finish())
+        self.assertEqual(self.started, ['H0', 'H2'])
+
+    def test_broker_failure(self):
+        with mock.patch.object(tasks.BuildTask, 'apply_async', side_effect=IOError('broker down')):
+            with self.assertRaises(IOError):
+                self.coalescer.submit('H0')
+        self.coalescer.submit('H1')
+        self.assertEqual(self.started, ['H1'])
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+)
+class SynchronizationTest(TestCase):
+
+    def setUp(self):
+        self.site = Site.objects.create(domain='testserver', name='testserver')
+        self.user = get_user_model().objects.create_user('alice')
+        UserSocialAuth.objects.create(
+            user=self.user,
+            provider='github',
+            uid='1',
+            extra_data={'access_token': 'token'}
+        )
+        for github, name in ((1, 'slides'), (2, 'talk'), (3, 'stale')):
+            models.Repository.objects.create(
+                site=self.site,
+                user=self.user,
+                github=github,
+                name=name
+            )
+
+    @mock.patch('qraz.frontend.tasks.get_client')
+    def test_changes(self, get_client):
+        get_client.return_value.get_repos.return_value = [
+            {'id': 1, 'name': 'slides', 'fork': False},
+            {'id': 2, 'name': 'lecture', 'fork': True},
+            {'id': 4, 'name': 'new', 'fork': False},
+        ]
+        tasks.SynchronizationTask().run(self.user.pk, self.site.pk)
+        self.assertEqual(
+            list(models.Repository.objects.order_by('github').values_list('github', 'name', 'fork')),
+            [
+                (1, 'slides', False),
+                (2, 'lecture', True),
+                (4, 'new', False),
+            ]
+        )
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+)
+class CommitTransitionTest(TestCase):
+
+    def setUp(self):
+        site = Site.objects.create(domain='testserver', name='testserver')
+        user = get_user_model().objects.create_user('alice')
+        self.repository = models.Repository.objects.create(
+            site=site,
+            user=user,
+            github=1,
+            name='slides'
+        )
+        self.before = tasks.snapshot(self.repository)
+        self.repository.hook = 42
+
+    def test_commit(self):
+        # Fields the transition did not change are not written back.
+        models.Repository.objects.update(name='renamed')
+        state = tasks.commit_transition(self.repository, 'state', 'inactive', self.before)
+        self.assertEqual(state, 'inactive')
+        self.assertEqual(
+            models.Repository.objects.values_list('name', 'hook').get(),
+            ('renamed', 42)
+        )
+
+    def test_conflict(self):
+        models.Repository.objects.update(state='active')
+        state = tasks.commit_transition(self.repository, 'state', 'inactive', self.before)
+        self.assertEqual(state, 'active')
+        self.assertIsNone(models.Repository.objects.values_list('hook', flat=True).get())
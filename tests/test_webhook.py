@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import hmac
+import json
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.test import (
+    TestCase,
+    override_settings,
+)
+
+from qraz.frontend import models
+
+
+@override_settings(
+    CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+)
+class WebHookTest(TestCase):
+
+    def setUp(self):
+        site = Site.objects.create(domain='testserver', name='testserver')
+        user = get_user_model().objects.create_user('alice')
+        self.repository = models.Repository.objects.create(
+            site=site,
+            user=user,
+            github=1,
+            name='slides'
+        )
+
+    def send(self, event, payload, header, digestmod, secret=None, **extra):
+        body = json.dumps(payload).encode('utf-8')
+        mac = hmac.new((secret or self.repository.secret).encode('utf-8'), msg=body, digestmod=digestmod)
+        extra[header] = '{}={}'.format(digestmod().name, mac.hexdigest())
+        return self.client.post(
+            '/webhook/alice/slides',
+            body,
+            content_type='application/json',
+            HTTP_X_GITHUB_EVENT=event,
+            **extra
+        )
+
+    def ping(self, header, digestmod, secret=None):
+        return self.send('ping', {'hook_id': 42}, header, digestmod, secret)
+
+    def test_sha256(self):
+        response = self.ping('HTTP_X_HUB_SIGNATURE_256', hashlib.sha256)
+        self.assertEqual(response.status_code, 200)
+        self.repository.refresh_from_db()
+        self.assertEqual(self.repository.hook, 42)
+
+    def test_sha1(self):
+        response = self.ping('HTTP_X_HUB_SIGNATURE', hashlib.sha1)
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalid_signature(self):
+        response = self.ping('HTTP_X_HUB_SIGNATURE_256', hashlib.sha256, secret='wrong')
+        self.assertEqual(response.status_code, 400)
+        self.repository.refresh_from_db()
+        self.assertIsNone(self.repository.hook)
+
+    def push(self):
+        payload = {
+            'ref': 'refs/heads/master',
+            'after': 'a' * 40,
+            'repository': {'default_branch': 'master'},
+            'commits': [],
+        }
+        response = self.send(
+            'push',
+            payload,
+            'HTTP_X_HUB_SIGNATURE_256',
+            hashlib.sha256,
+            HTTP_X_GITHUB_DELIVERY='72d3162e-cc78-11e3-81ab-4c9367dc0958'
+        )
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content.decode('utf-8'))
+
+    @mock.patch('qraz.frontend.journal.notify')
+    def test_redelivery(self, notify):
+        for queued in (True, False):
+            self.assertEqual(self.push()['queued'], queued)
+        event = models.Event.objects.get()
+        self.assertEqual(event.head, 'a' * 40)
+        # Accepting a push never talks to the broker.
+        self.assertIsNone(event.dispatched)